@@ -0,0 +1,451 @@
+"""Offline benchmark for the music bot's command handlers.
+
+Drives play/skip/queue/stop against a fake Discord context and voice client,
+a local aiohttp stand-in for the Invidious API and a stubbed yt-dlp, so it
+needs neither a token nor the internet:
+
+    python bench.py --guilds 1,10,100 --plays 10
+    python bench.py --latency-ms 80 --failure-rate 0.2 --dead-instances 2 --json
+    python bench.py --max-play-p99-ms 500   # exit 1 on regression
+
+Startup cost (importing the bot, then loading yt-dlp) is measured in fresh
+interpreters and reported alongside peak RSS.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+# Configure the bot for offline use before it is imported
+os.environ.setdefault('RESOLUTION_CACHE_DB', '')
+os.environ.setdefault('AUDIO_CACHE_MAX_MB', '0')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('CHANNEL_RATE_LIMIT', '1000000')  # Measure the bot, not Discord's limit
+os.environ.setdefault('REPLY_COALESCE_WINDOW', '0')
+os.environ.setdefault('SESSION_DB', '')
+
+BENCH_PORT = 18700
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', default='1,10,50', help="comma-separated concurrent guild counts")
+    parser.add_argument('--plays', type=int, default=10, help="!play commands per guild")
+    parser.add_argument('--unique-songs', type=int, default=200, help="size of the query pool")
+    parser.add_argument('--skips', type=int, default=3, help="!skip commands per guild")
+    parser.add_argument('--instances', type=int, default=3, help="healthy stub Invidious instances")
+    parser.add_argument('--dead-instances', type=int, default=0, help="instances that refuse connections")
+    parser.add_argument('--latency-ms', type=float, default=40, help="stub Invidious latency per request")
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of stub requests answering 500")
+    parser.add_argument('--ytdl-latency-ms', type=float, default=300, help="stubbed extract_info latency")
+    parser.add_argument('--ytdl-failure-rate', type=float, default=0.0)
+    parser.add_argument('--track-seconds', type=float, default=180, help="simulated track duration")
+    parser.add_argument('--time-scale', type=float, default=60, help="simulated seconds per real second")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log output")
+    parser.add_argument('--max-play-p99-ms', type=float, default=None, help="fail if !play p99 exceeds this")
+    parser.add_argument('--startup-runs', type=int, default=3, help="fresh interpreters used to time startup")
+    parser.add_argument('--startup-probe', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)  # bytes on macOS, KiB elsewhere
+
+def probe_startup():
+    """Runs in a fresh interpreter: cost of importing the bot, then of yt-dlp"""
+    start = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    import_rss = peak_rss_mib()
+    main.run_warmup(main.current_ytdl_config)
+    return {
+        'import_ms': (imported - start) * 1000,
+        'import_rss_mib': import_rss,
+        'ytdl_load_ms': (time.perf_counter() - imported) * 1000,
+        'ytdl_rss_mib': peak_rss_mib(),
+    }
+
+ARGS = parse_args() if __name__ == '__main__' else None
+if ARGS and ARGS.startup_probe:
+    with contextlib.redirect_stdout(io.StringIO()):
+        probe = probe_startup()
+    print(json.dumps(probe))
+    sys.exit(0)
+if ARGS:
+    os.environ.setdefault('INVIDIOUS_INSTANCES', ",".join(
+        [f"http://127.0.0.1:{BENCH_PORT + i}" for i in range(ARGS.instances)]
+        + [f"http://127.0.0.1:{BENCH_PORT - 1 - i}" for i in range(ARGS.dead_instances)]
+    ))
+
+import discord.player  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+# Fake FFmpeg
+class FakeProcess:
+    """Stands in for an FFmpeg subprocess and counts how many are alive"""
+    lock = threading.Lock()
+    alive = 0
+    peak = 0
+    spawned = 0
+
+    def __init__(self, args, **kwargs):
+        self.args = args
+        self.pid = 0
+        self.returncode = None
+        self.stdout = io.BytesIO(b'\0' * 3840 * 4)
+        self.stdin = None
+        self.stderr = None
+        with FakeProcess.lock:
+            FakeProcess.alive += 1
+            FakeProcess.spawned += 1
+            FakeProcess.peak = max(FakeProcess.peak, FakeProcess.alive)
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            self.returncode = -9
+            with FakeProcess.lock:
+                FakeProcess.alive -= 1
+
+    def communicate(self, *args, **kwargs):
+        return b'', b''
+
+    def wait(self, *args, **kwargs):
+        return self.returncode
+
+real_popen = subprocess.Popen  # discord.player shares the module, so keep this for the startup probe
+discord.player.subprocess.Popen = FakeProcess
+
+# Stubbed yt-dlp
+class FakeYoutubeDL:
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def extract_info(self, url, download=False, process=True):
+        time.sleep(max(0.0, random.gauss(ARGS.ytdl_latency_ms, ARGS.ytdl_latency_ms / 5)) / 1000)
+        if random.random() < ARGS.ytdl_failure_rate:
+            raise Exception("stub extraction failure")
+        video_id = video_id_for(url)
+        return {
+            'id': video_id,
+            'url': f"http://127.0.0.1/stream/{video_id}?expire={int(time.time()) + 6 * 3600}",
+            'title': f"Song {video_id}",
+            'duration': ARGS.track_seconds,
+            'acodec': 'opus',
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'extractor_key': 'Youtube',
+        }
+
+    def prepare_filename(self, data):
+        return f"{data['id']}.webm"
+
+    def sanitize_info(self, data):
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def video_id_for(query):
+    if 'watch?v=' in query:
+        return query.rsplit('=', 1)[1]
+    return hashlib.sha1(query.encode()).hexdigest()[:11]
+
+# Stub Invidious API
+def make_invidious_app():
+    async def maybe_fail():
+        await asyncio.sleep(max(0.0, random.gauss(ARGS.latency_ms, ARGS.jitter_ms)) / 1000)
+        return random.random() < ARGS.failure_rate
+
+    async def search(request):
+        if await maybe_fail():
+            return web.json_response({'error': 'stub failure'}, status=500)
+        return web.json_response([{'videoId': video_id_for(request.query['q'])}])
+
+    async def video(request):
+        if await maybe_fail():
+            return web.json_response({'error': 'stub failure'}, status=500)
+        video_id = request.match_info['video_id']
+        return web.json_response({
+            'title': f"Song {video_id}",
+            'duration': ARGS.track_seconds,
+            'adaptiveFormats': [{
+                'type': 'audio/webm; codecs="opus"',
+                'encoding': 'opus',
+                'bitrate': 160000,
+                'url': f"http://127.0.0.1/stream/{video_id}?expire={int(time.time()) + 6 * 3600}",
+            }],
+        })
+
+    app = web.Application()
+    app.router.add_get('/api/v1/search', search)
+    app.router.add_get('/api/v1/videos/{video_id}', video)
+    return app
+
+# Fake Discord
+class FakeVoiceClient:
+    """Plays sources on simulated time and fires `after` like the voice thread"""
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self.source = None
+        self.paused = False
+        self.playback = None
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def is_connected(self):
+        return True
+
+    def play(self, source, *, after=None):
+        self.source = source
+        self.playback = asyncio.get_running_loop().create_task(self.run(source, after))
+
+    async def run(self, source, after):
+        source.read()
+        duration = source.data.get('duration') or ARGS.track_seconds
+        tick = 0.05
+        try:
+            while source.elapsed < duration:
+                await asyncio.sleep(tick)
+                if not self.paused:
+                    source.frames += int(tick * ARGS.time_scale / source.FRAME_SECONDS)
+        except asyncio.CancelledError:
+            pass
+        self.finish(source, after)
+
+    def finish(self, source, after):
+        if self.source is source:
+            self.source = None
+            source.cleanup()
+            # The real voice thread calls this from another thread
+            threading.Thread(target=after, args=(None,)).start()
+
+    def stop(self):
+        if self.playback and not self.playback.done():
+            self.playback.cancel()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.guild.voice_client = None
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.guild = guild
+        self.name = f"voice-{guild.id}"
+        self.members = []
+
+    async def connect(self, **kwargs):
+        self.guild.voice_client = FakeVoiceClient(self.guild, self)
+        return self.guild.voice_client
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.shard_id = 0
+        self.voice_client = None
+
+class FakeTextChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeMember:
+    def __init__(self, channel):
+        self.voice = type('VoiceState', (), {'channel': channel})()
+
+class FakeContext:
+    interaction = None  # Prefix invocation
+
+    def __init__(self, guild, channel, member):
+        self.guild = guild
+        self.channel = channel
+        self.author = member
+        self.sent = 0
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    def typing(self):
+        return FakeTyping()
+
+    async def defer(self):
+        pass
+
+    async def send(self, content=None, *, embed=None):
+        self.sent += 1
+
+# Workload
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def timed(samples, coro):
+    start = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - start)
+
+async def guild_session(main, guild_id, songs, timings):
+    guild = FakeGuild(guild_id)
+    ctx = FakeContext(guild, FakeTextChannel(guild_id), FakeMember(FakeVoiceChannel(guild)))
+    for _ in range(ARGS.plays):
+        query = f"song {random.choice(songs)}"
+        await timed(timings['play'], main.play.callback(ctx, query=query))
+    await timed(timings['queue'], main.queue.callback(ctx))
+    return ctx
+
+def reset_state(main):
+    for guild_id in list(main.players):
+        main.destroy_player(guild_id)
+    main.query_cache.entries.clear()
+    main.stream_cache.entries.clear()
+    for cache in (main.query_cache, main.stream_cache):
+        cache.hits = cache.misses = 0
+    main.transition_gaps.clear()
+    FakeProcess.peak = FakeProcess.alive
+
+async def run_scenario(main, guild_count):
+    reset_state(main)
+    random.seed(ARGS.seed)
+    songs = list(range(ARGS.unique_songs))
+    timings = {'play': [], 'queue': [], 'skip': [], 'stop': []}
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    contexts = await asyncio.gather(*[guild_session(main, 10_000 + i, songs, timings) for i in range(guild_count)])
+    play_wall = time.perf_counter() - start
+    per_guild_bytes = (tracemalloc.get_traced_memory()[0] - baseline) / guild_count
+    tracemalloc.stop()
+    ffmpeg_peak = FakeProcess.peak
+
+    for _ in range(ARGS.skips):
+        await asyncio.gather(*[timed(timings['skip'], main.skip.callback(ctx)) for ctx in contexts])
+        await asyncio.sleep(0.05)
+    gaps = list(main.transition_gaps)
+    await asyncio.gather(*[timed(timings['stop'], main.stop.callback(ctx)) for ctx in contexts])
+    await asyncio.sleep(0.2)
+    ffmpeg_after_stop = FakeProcess.alive
+    for ctx in contexts:
+        await ctx.voice_client.disconnect()
+        main.destroy_player(ctx.guild.id)
+
+    return {
+        'guilds': guild_count,
+        'plays': len(timings['play']),
+        'play_p50_ms': percentile(timings['play'], 0.5) * 1000,
+        'play_p99_ms': percentile(timings['play'], 0.99) * 1000,
+        'plays_per_second': len(timings['play']) / play_wall,
+        'queue_p50_ms': percentile(timings['queue'], 0.5) * 1000,
+        'skip_p50_ms': percentile(timings['skip'], 0.5) * 1000,
+        'stop_p50_ms': percentile(timings['stop'], 0.5) * 1000,
+        'transition_gap_p50_ms': percentile(gaps, 0.5) * 1000,
+        'kib_per_guild': per_guild_bytes / 1024,
+        'ffmpeg_peak': ffmpeg_peak,
+        'ffmpeg_after_stop': ffmpeg_after_stop,
+        'cache_hit_rate': main.query_cache.hits / max(1, main.query_cache.hits + main.query_cache.misses),
+        'peak_rss_mib': peak_rss_mib(),
+    }
+
+def measure_startup():
+    """Best of a few cold imports, each in its own interpreter"""
+    samples = []
+    for _ in range(ARGS.startup_runs):
+        with real_popen([sys.executable, os.path.abspath(__file__), '--startup-probe'],
+                        stdout=subprocess.PIPE, text=True) as process:
+            output = process.communicate()[0]
+        if process.returncode:
+            raise RuntimeError(f"startup probe exited with {process.returncode}")
+        samples.append(json.loads(output.splitlines()[-1]))
+    return min(samples, key=lambda sample: sample['import_ms'])
+
+def print_table(results):
+    columns = [
+        ('guilds', 'guilds', '{:>6}'), ('plays', 'plays', '{:>6}'),
+        ('play p50', 'play_p50_ms', '{:>9.1f}'), ('play p99', 'play_p99_ms', '{:>9.1f}'),
+        ('plays/s', 'plays_per_second', '{:>8.1f}'), ('queue p50', 'queue_p50_ms', '{:>9.2f}'),
+        ('skip p50', 'skip_p50_ms', '{:>8.2f}'), ('gap p50', 'transition_gap_p50_ms', '{:>8.1f}'),
+        ('KiB/guild', 'kib_per_guild', '{:>9.1f}'), ('ffmpeg peak', 'ffmpeg_peak', '{:>11}'),
+        ('ffmpeg left', 'ffmpeg_after_stop', '{:>11}'), ('cache hit', 'cache_hit_rate', '{:>9.0%}'),
+        ('RSS MiB', 'peak_rss_mib', '{:>8.1f}'),
+    ]
+    print("  ".join(f"{title:>{len(fmt.format(0)) if 'd' not in fmt else 6}}" for title, _, fmt in columns))
+    for result in results:
+        print("  ".join(fmt.format(result[key]) for _, key, fmt in columns))
+
+async def run():
+    runners = []
+    for index in range(ARGS.instances):
+        runner = web.AppRunner(make_invidious_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', BENCH_PORT + index).start()
+        runners.append(runner)
+
+    import main
+    main.yt_dlp = types.SimpleNamespace(YoutubeDL=FakeYoutubeDL)  # Stands in for the lazily imported module
+    main.bot.loop = asyncio.get_running_loop()
+
+    results = []
+    try:
+        for guild_count in [int(value) for value in ARGS.guilds.split(',')]:
+            results.append(await run_scenario(main, guild_count))
+    finally:
+        await main.close_http_session()
+        main.shutdown_ytdl_executor()
+        for runner in runners:
+            await runner.cleanup()
+    return results
+
+if __name__ == '__main__':
+    startup = measure_startup() if ARGS.startup_runs > 0 else None
+    with contextlib.redirect_stdout(sys.stdout if ARGS.verbose else io.StringIO()):
+        results = asyncio.run(run())
+    if ARGS.json:
+        print(json.dumps({'startup': startup, 'scenarios': results}, indent=2))
+    else:
+        if startup:
+            print(f"startup: import {startup['import_ms']:.0f}ms, peak RSS {startup['import_rss_mib']:.1f} MiB • "
+                  f"yt-dlp on first use +{startup['ytdl_load_ms']:.0f}ms, {startup['ytdl_rss_mib']:.1f} MiB")
+        print_table(results)
+    if ARGS.max_play_p99_ms is not None and any(r['play_p99_ms'] > ARGS.max_play_p99_ms for r in results):
+        print(f"❌ !play p99 above {ARGS.max_play_p99_ms}ms", file=sys.stderr)
+        sys.exit(1)
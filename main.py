@@ -1,22 +1,386 @@
 import os
 import discord
+from discord import app_commands
 from discord.ext import commands
-import yt_dlp
 import asyncio
 import aiohttp
+from aiohttp import web
+import heapq
+import importlib
+import itertools
 import json
 import random
+import secrets
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
 import time
+import unicodedata
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict, deque
+from multiprocessing.managers import BaseManager, DictProxy
+from operator import attrgetter, itemgetter
+from urllib.parse import urlparse, parse_qs
+
+boot_started_at = time.monotonic()  # Startup time is measured from here to the first on_ready
+startup_seconds = None
+
+# Shared HTTP session for all Invidious traffic (created in setup_hook)
+HTTP_POOL_LIMIT = int(os.environ.get('HTTP_POOL_LIMIT', 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get('HTTP_POOL_LIMIT_PER_HOST', 10))
+HTTP_DNS_CACHE_TTL = int(os.environ.get('HTTP_DNS_CACHE_TTL', 300))
+HTTP_KEEPALIVE_TIMEOUT = int(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 30))
+http_session = None
+
+def get_http_session():
+    """Return the bot-lifetime aiohttp session, creating it if needed"""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        http_session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+    return http_session
+
+async def close_http_session():
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+# Metrics
+# In-process counters/histograms rendered in Prometheus text format on
+# METRICS_HOST:METRICS_PORT/metrics and summarized in !status.
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9108))  # 0 disables the endpoint
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+metrics = []
+metric_collectors = []  # Callables producing gauge lines at scrape time
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            lines.extend(f"{self.name}{format_labels(key)} {value}" for key, value in self.values.items())
+        return lines
+
+class Histogram:
+    """Bucketed latency histogram that also keeps recent samples for quantiles"""
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts, sum, count, recent samples]
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=256)]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+            series[3].append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, q, **labels):
+        with self.lock:
+            series = self.series.get(tuple(sorted(labels.items())))
+            samples = sorted(series[3]) if series else []
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count, _) in self.series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+stage_latency = Histogram('musicbot_stage_seconds', "Latency of playback and resolution stages")
+stage_results = Counter('musicbot_stage_total', "Stage outcomes by stage and result")
+instance_latency = Histogram('musicbot_invidious_instance_seconds', "Invidious lookup latency per instance")
+instance_results = Counter('musicbot_invidious_instance_total', "Invidious lookup outcomes per instance")
+command_latency = Histogram('musicbot_command_seconds', "Command handler latency")
+
+@contextmanager
+def track_stage(stage, **labels):
+    """Time a stage and count whether it succeeded"""
+    start = time.perf_counter()
+    result = 'ok'
+    try:
+        yield
+    except asyncio.CancelledError:
+        result = 'cancelled'
+        raise
+    except BaseException:
+        result = 'error'
+        raise
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage=stage, **labels)
+        stage_results.inc(stage=stage, result=result, **labels)
+
+def gauge_lines(name, description, samples):
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}" for labels, value in samples)
+    return lines
+
+def render_metrics():
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.expose())
+    for collect in metric_collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+def latency_summary(histogram, **labels):
+    """Recent p50/p95 for !status"""
+    p50 = histogram.quantile(0.5, **labels)
+    if p50 is None:
+        return "-"
+    return f"{p50 * 1000:.0f}/{histogram.quantile(0.95, **labels) * 1000:.0f}ms"
+
+async def handle_metrics(request):
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+
+async def handle_health(request):
+    """Liveness: the event loop is answering"""
+    return web.Response(text="ok")
+
+async def handle_ready(request):
+    """Readiness: connected to the gateway and able to take commands"""
+    ready = bot.is_ready() and not bot.is_closed()
+    return web.json_response({
+        'ready': ready,
+        'startup_seconds': startup_seconds,
+        'uptime_seconds': round(time.monotonic() - boot_started_at, 1),
+        'guilds': len(bot.guilds),
+        'voice_sessions': len(bot.voice_clients),
+        'ytdl_loaded': yt_dlp is not None,
+    }, status=200 if ready else 503)
+
+http_runner = None
+
+async def start_http_endpoints():
+    """Serve /metrics and the /healthz and /readyz probes locally; failures only disable the endpoint"""
+    global http_runner
+    if not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/healthz', handle_health)
+    app.router.add_get('/readyz', handle_ready)
+    http_runner = web.AppRunner(app, access_log=None)
+    await http_runner.setup()
+    try:
+        await web.TCPSite(http_runner, METRICS_HOST, METRICS_PORT).start()
+        print(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"Metrics endpoint disabled: {e}")
+
+async def stop_http_endpoints():
+    global http_runner
+    if http_runner is not None:
+        await http_runner.cleanup()
+        http_runner = None
+
+# Sharding
+# SHARD_COUNT/SHARD_IDS run this process as an AutoShardedBot owning those
+# shards. SHARD_PROCESSES > 1 turns `python main.py` into a supervisor that
+# splits the shards across worker processes and aggregates their stats.
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 0))  # 0 = let Discord decide
+SHARD_IDS = os.environ.get('SHARD_IDS', '')  # e.g. "0-3" or "0,2,4"; empty = all shards
+SHARD_PROCESSES = int(os.environ.get('SHARD_PROCESSES', 1))
+AUTO_SHARD = os.environ.get('AUTO_SHARD', '0') == '1' or SHARD_COUNT > 0 or SHARD_PROCESSES > 1
+SHARD_COORDINATOR = os.environ.get('SHARD_COORDINATOR', '')  # host:port of the supervisor, set for workers
+SHARD_COORDINATOR_KEY = os.environ.get('SHARD_COORDINATOR_KEY', '')
+SHARD_LABEL = os.environ.get('SHARD_LABEL', 'main')
+SHARD_STATS_INTERVAL = int(os.environ.get('SHARD_STATS_INTERVAL', 15))
+
+def parse_shard_ids(value):
+    shard_ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            shard_ids.extend(range(int(first), int(last) + 1))
+        elif part:
+            shard_ids.append(int(part))
+    return shard_ids
+
+class ShardCoordinator(BaseManager):
+    """Local channel the worker processes publish their stats through"""
+
+shard_stats_store = {}  # Lives in the supervisor process
+
+def get_shard_stats_store():
+    return shard_stats_store
+
+ShardCoordinator.register('stats', callable=get_shard_stats_store, proxytype=DictProxy)
+shard_stats = None  # DictProxy in worker processes
+
+def connect_shard_coordinator():
+    global shard_stats
+    host, port = SHARD_COORDINATOR.rsplit(':', 1)
+    manager = ShardCoordinator(address=(host, int(port)), authkey=bytes.fromhex(SHARD_COORDINATOR_KEY))
+    manager.connect()
+    shard_stats = manager.stats()
+
+def shard_snapshot():
+    """This process's share of the aggregate !status numbers"""
+    per_shard = {}
+    for guild_id, player in players.items():
+        shard_id = player.guild.shard_id
+        per_shard[shard_id] = per_shard.get(shard_id, 0) + 1
+    return {
+        'shards': sorted(bot.shards) if AUTO_SHARD else [0],
+        'guilds': len(bot.guilds),
+        'players': len(players),
+        'playing': sum(1 for player in players.values() if player.current),
+        'queued': sum(len(player.queue) for player in players.values()),
+        'players_per_shard': per_shard,
+        'latency_ms': round(bot.latency * 1000),
+        'updated': time.time(),
+    }
+
+async def publish_shard_stats():
+    """Push this worker's stats to the supervisor, reconnecting while it is unreachable"""
+    loop = asyncio.get_running_loop()
+    connected = False
+    retry = 1
+    while True:
+        try:
+            if not connected:
+                await loop.run_in_executor(None, connect_shard_coordinator)
+                connected = True
+            await loop.run_in_executor(None, shard_stats.__setitem__, SHARD_LABEL, shard_snapshot())
+        except Exception as e:
+            print(f"Failed to publish shard stats, retrying in {retry}s: {e}")
+            connected = False
+            await asyncio.sleep(retry)
+            retry = min(retry * 2, SHARD_STATS_INTERVAL * 4)
+            continue
+        retry = 1
+        await asyncio.sleep(SHARD_STATS_INTERVAL)
+
+async def collect_shard_stats():
+    """Stats from every live worker process, or None when not supervised"""
+    if shard_stats is None:
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        stats = await loop.run_in_executor(None, shard_stats.copy)
+    except Exception as e:
+        print(f"Failed to read shard stats: {e}")
+        return None
+    stale = time.time() - 3 * SHARD_STATS_INTERVAL
+    return [entry for entry in stats.values() if entry['updated'] >= stale]
+
+BotBase = commands.AutoShardedBot if AUTO_SHARD else commands.Bot
+
+class MusicBot(BotBase):
+    async def setup_hook(self):
+        get_http_session()
+        await start_http_endpoints()
+        if SHARD_COORDINATOR:
+            self.loop.create_task(publish_shard_stats())
+        if SYNC_COMMANDS and SHARD_LABEL in ('main', 'worker-0'):
+            try:
+                await self.tree.sync()
+            except discord.HTTPException as e:
+                print(f"Failed to sync slash commands: {e}")
+        if REAPER_INTERVAL > 0:
+            self.loop.create_task(idle_reaper_loop())
+
+    async def close(self):
+        # Save sessions while voice clients and players still exist
+        await snapshot_sessions()
+        await super().close()
+        await close_http_session()
+        await stop_http_endpoints()
+        shutdown_ytdl_executor()
+        if cache_writer:
+            cache_writer.close()
+
+def shard_options():
+    if not AUTO_SHARD:
+        return {}
+    options = {}
+    if SHARD_COUNT:
+        options['shard_count'] = SHARD_COUNT
+    if SHARD_IDS:
+        options['shard_ids'] = parse_shard_ids(SHARD_IDS)
+    return options
 
 # Bot setup
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Register slash commands on startup. Discord rate-limits syncs, so set this
+# for one deploy after the commands change rather than on every boot.
+SYNC_COMMANDS = os.environ.get('SYNC_COMMANDS', '0') == '1'
+FULL_INTENTS = os.environ.get('FULL_INTENTS', '0') == '1'  # Request every intent, as older versions did
+
+def bot_intents():
+    """Only what the music commands use; members/presences would make Discord chunk every guild on connect"""
+    if FULL_INTENTS:
+        return discord.Intents.all()
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.voice_states = True
+    intents.guild_messages = True
+    intents.message_content = True
+    return intents
+
+intents = bot_intents()
+bot = MusicBot(command_prefix='!', intents=intents, **shard_options())
 
 # Large Image URL
 LARGE_IMAGE_URL = "https://media.discordapp.net/attachments/856506862107492402/1425324515034009662/image.png?ex=68e72c65&is=68e5dae5&hm=390850b95ebb0c2bc1eacddd8bdaba22eef053c967a638122fe570bdfb18b724&=&format=webp&quality=lossless"
 
-# Music queues
-queues = {}
+# Per-guild players (each owns its track queue and playback task)
+players = {}
 
 # Track usage to detect when to switch methods
 usage_count = 0
@@ -24,6 +388,11 @@ last_method_switch = time.time()
 current_primary_method = "invidious"  # Start with invidious
 current_ytdl_config = 0
 
+# Opus passthrough: let FFmpeg hand Discord Opus packets directly instead of
+# decoding to PCM and re-encoding in-process
+OPUS_PASSTHROUGH = os.environ.get('OPUS_PASSTHROUGH', '0') == '1'
+DEFAULT_VOLUME = 1.0 if OPUS_PASSTHROUGH else 0.5
+
 # FFmpeg options
 ffmpeg_options = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
@@ -88,84 +457,716 @@ ytdl_configs = [
     }
 ]
 
-def get_current_ytdl():
-    """Get current yt-dlp configuration"""
-    return yt_dlp.YoutubeDL(ytdl_configs[current_ytdl_config])
+# Dedicated extraction pool so yt-dlp never competes with the default executor
+YTDL_WORKERS = int(os.environ.get('YTDL_WORKERS', 4))
+YTDL_EXECUTOR = os.environ.get('YTDL_EXECUTOR', 'thread')  # "thread" or "process"
+ytdl_executor = None
+YTDL_WARMUP = os.environ.get('YTDL_WARMUP', '1') == '1'  # Load yt-dlp in the background once connected
+ytdl_local = threading.local()  # YoutubeDL instances per worker, keyed by config
+yt_dlp = None  # Imported on first use; it is slow to load and not needed to connect
+ytdl_warmup_task = None
+inflight_extractions = {}
 
-# Embed creation function with LARGE IMAGE
-def create_embed(title, description, color=0x00ff00, show_large_image=True):
-    """Create embed message with LARGE image (not thumbnail)"""
-    embed = discord.Embed(
-        title=title,
-        description=description,
-        color=color,
-        timestamp=discord.utils.utcnow()
+# Playlist enumeration runs on its own small pool so long playlists never
+# starve single-track extraction
+PLAYLIST_WORKERS = int(os.environ.get('PLAYLIST_WORKERS', 2))
+PLAYLIST_MAX_TRACKS = int(os.environ.get('PLAYLIST_MAX_TRACKS', 5000))
+PLAYLIST_BATCH_SIZE = int(os.environ.get('PLAYLIST_BATCH_SIZE', 50))
+PLAYLIST_MAX_REDIRECTS = 5
+playlist_executor = None
+
+def load_yt_dlp():
+    global yt_dlp
+    if yt_dlp is None:
+        yt_dlp = importlib.import_module('yt_dlp')
+    return yt_dlp
+
+def get_current_ytdl(config_index=None):
+    """Get current yt-dlp configuration (reused per worker thread/process)"""
+    if config_index is None:
+        config_index = current_ytdl_config
+    instances = getattr(ytdl_local, 'instances', None)
+    if instances is None:
+        instances = ytdl_local.instances = {}
+    if config_index not in instances:
+        instances[config_index] = load_yt_dlp().YoutubeDL(ytdl_configs[config_index])
+    return instances[config_index]
+
+def run_extract(config_index, url, download):
+    """Worker entry point: returns (info, filename) as plain picklable data"""
+    ytdl = get_current_ytdl(config_index)
+    data = ytdl.extract_info(url, download=download)
+    if data and 'entries' in data:
+        data = data['entries'][0]
+    filename = ytdl.prepare_filename(data) if download else None
+    return ytdl.sanitize_info(data), filename
+
+def run_cache_download(config_index, url, cache_dir):
+    """Worker entry point: download a track into the audio cache, preferring Opus"""
+    options = {
+        **ytdl_configs[config_index],
+        'format': 'bestaudio[acodec=opus]/bestaudio/best',
+        'outtmpl': os.path.join(cache_dir, '%(id)s.%(ext)s'),
+    }
+    with load_yt_dlp().YoutubeDL(options) as ytdl:
+        data = ytdl.extract_info(url, download=True)
+        if data and 'entries' in data:
+            data = data['entries'][0]
+        return ytdl.prepare_filename(data), data.get('acodec')
+
+def get_playlist_ytdl(config_index):
+    """Flat, lazy playlist extractor for the given config (reused per worker thread)"""
+    instances = getattr(ytdl_local, 'instances', None)
+    if instances is None:
+        instances = ytdl_local.instances = {}
+    key = ('playlist', config_index)
+    if key not in instances:
+        instances[key] = load_yt_dlp().YoutubeDL({**ytdl_configs[config_index], 'noplaylist': False, 'extract_flat': 'in_playlist'})
+    return instances[key]
+
+def run_warmup(config_index):
+    """Worker entry point: import yt-dlp and build this worker's extractor"""
+    get_current_ytdl(config_index)
+
+async def warm_ytdl():
+    start = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(get_ytdl_executor(), run_warmup, current_ytdl_config)
+    except Exception as e:
+        print(f"yt-dlp warmup failed: {e}")
+        return
+    stage_latency.observe(time.perf_counter() - start, stage='ytdl_warmup')
+
+def start_ytdl_warmup():
+    global ytdl_warmup_task
+    if YTDL_WARMUP and ytdl_warmup_task is None:
+        ytdl_warmup_task = bot.loop.create_task(warm_ytdl())
+
+def get_ytdl_executor():
+    global ytdl_executor
+    if ytdl_executor is None:
+        if YTDL_EXECUTOR == 'process':
+            ytdl_executor = ProcessPoolExecutor(max_workers=YTDL_WORKERS)
+        else:
+            ytdl_executor = ThreadPoolExecutor(max_workers=YTDL_WORKERS, thread_name_prefix='ytdl')
+    return ytdl_executor
+
+def get_playlist_executor():
+    global playlist_executor
+    if playlist_executor is None:
+        playlist_executor = ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS, thread_name_prefix='playlist')
+    return playlist_executor
+
+def shutdown_ytdl_executor():
+    global ytdl_executor, playlist_executor
+    if ytdl_executor is not None:
+        ytdl_executor.shutdown(wait=False, cancel_futures=True)
+        ytdl_executor = None
+    if playlist_executor is not None:
+        playlist_executor.shutdown(wait=False, cancel_futures=True)
+        playlist_executor = None
+
+async def extract_info(url, *, download=False, loop=None):
+    """Run yt-dlp in the extraction pool, sharing one job per identical request"""
+    loop = loop or asyncio.get_event_loop()
+    key = (current_ytdl_config, " ".join(url.split()), download)
+    future = inflight_extractions.get(key)
+    if future is None:
+        future = loop.run_in_executor(get_ytdl_executor(), run_extract, current_ytdl_config, url, download)
+        inflight_extractions[key] = future
+        future.add_done_callback(lambda _: inflight_extractions.pop(key, None))
+    # Shield so one cancelled caller does not cancel the shared job
+    return await asyncio.shield(future)
+
+# Resolution cache
+# query -> video id is kept long-term; video id -> stream data is kept until
+# shortly before the signed stream URL expires.
+RESOLUTION_CACHE_DB = os.environ.get('RESOLUTION_CACHE_DB', 'resolution_cache.db')  # Empty to disable persistence
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 5000))
+QUERY_CACHE_TTL = int(os.environ.get('QUERY_CACHE_TTL', 7 * 24 * 3600))
+STREAM_CACHE_SIZE = int(os.environ.get('STREAM_CACHE_SIZE', 2000))
+STREAM_CACHE_TTL = int(os.environ.get('STREAM_CACHE_TTL', 3 * 3600))  # Used when the URL has no expire param
+STREAM_EXPIRY_MARGIN = int(os.environ.get('STREAM_EXPIRY_MARGIN', 600))  # Seconds kept in reserve before expiry
+
+# Fields kept from extractor output when caching stream data
+STREAM_FIELDS = ('id', 'url', 'title', 'duration', 'webpage_url', 'extractor_key', 'acodec', 'ext', 'instance')
+
+def open_cache_db(path):
+    """Open the SQLite file backing the resolution caches"""
+    if not path:
+        return None
+    try:
+        db = sqlite3.connect(path, check_same_thread=False)  # Loaded here, then written by CacheWriter's thread
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS resolution_cache ("
+            "namespace TEXT, key TEXT, value TEXT, expires_at REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        db.commit()
+        return db
+    except sqlite3.Error as e:
+        print(f"Resolution cache persistence disabled: {e}")
+        return None
+
+class CacheWriter:
+    """Applies cache writes on one background thread, committing each batch once"""
+    def __init__(self, db):
+        self.db = db
+        self.pending = []
+        self.scheduled = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-db')
+
+    def write(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+            if self.scheduled:
+                return  # Joins the batch already waiting for the writer thread
+            self.scheduled = True
+        self.executor.submit(self.flush)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+            self.scheduled = False
+        try:
+            for sql, params in batch:
+                self.db.execute(sql, params)
+            self.db.commit()
+        except sqlite3.Error as e:
+            print(f"Failed to write cache database: {e}")
+
+    def close(self):
+        """Finish queued writes"""
+        self.executor.shutdown(wait=True)
+
+class ResolutionCache:
+    """LRU cache with per-entry expiry, optionally persisted to SQLite"""
+    def __init__(self, name, maxsize, *, db=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.db = db
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if db:
+            self._load()
+
+    def _load(self):
+        try:
+            self.db.execute("DELETE FROM resolution_cache WHERE expires_at <= ?", (time.time(),))
+            rows = self.db.execute(
+                "SELECT key, value, expires_at FROM resolution_cache WHERE namespace = ? "
+                "ORDER BY expires_at DESC LIMIT ?", (self.name, self.maxsize)
+            ).fetchall()
+            self.db.commit()
+        except sqlite3.Error as e:
+            print(f"Failed to load {self.name} cache: {e}")
+            return
+        for key, value, expires_at in reversed(rows):
+            self.entries[key] = (json.loads(value), expires_at)
+
+    def _persist(self, sql, params):
+        if self.db:
+            cache_writer.write(sql, params)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, *, expires_at):
+        if expires_at <= time.time():
+            return
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        self._persist(
+            "INSERT OR REPLACE INTO resolution_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.name, key, json.dumps(value), expires_at)
+        )
+        while len(self.entries) > self.maxsize:
+            old_key, _ = self.entries.popitem(last=False)
+            self._persist("DELETE FROM resolution_cache WHERE namespace = ? AND key = ?", (self.name, old_key))
+
+    def delete(self, key):
+        if self.entries.pop(key, None) is not None:
+            self._persist("DELETE FROM resolution_cache WHERE namespace = ? AND key = ?", (self.name, key))
+
+    def stats(self):
+        return f"{self.hits}/{self.hits + self.misses} ({len(self.entries)} รายการ)"
+
+cache_db = open_cache_db(RESOLUTION_CACHE_DB)
+cache_writer = CacheWriter(cache_db) if cache_db else None
+query_cache = ResolutionCache("query", QUERY_CACHE_SIZE, db=cache_db)
+stream_cache = ResolutionCache("stream", STREAM_CACHE_SIZE, db=cache_db)
+
+def query_cache_key(query):
+    query = " ".join(query.split())
+    return query if query.startswith(('http://', 'https://')) else query.lower()
+
+def stream_cache_key(data):
+    extractor = data.get('extractor_key') or 'Youtube'
+    return data['id'] if extractor == 'Youtube' else f"{extractor}:{data['id']}"
+
+def stream_expires_at(data):
+    """When a resolved stream URL should no longer be handed out"""
+    expires_at = time.time() + STREAM_CACHE_TTL
+    expire = parse_qs(urlparse(data.get('url') or '').query).get('expire')
+    if expire and expire[0].isdigit():
+        expires_at = min(expires_at, int(expire[0]))
+    return expires_at - STREAM_EXPIRY_MARGIN
+
+def remember_resolution(query, data):
+    """Store query -> video id and video id -> stream data"""
+    if not data.get('id') or not data.get('url'):
+        return
+    key = stream_cache_key(data)
+    query_cache.set(
+        query_cache_key(query),
+        {'key': key, 'id': data['id'], 'webpage_url': data.get('webpage_url')},
+        expires_at=time.time() + QUERY_CACHE_TTL
     )
+    stream_cache.set(key, {k: data[k] for k in STREAM_FIELDS if k in data}, expires_at=stream_expires_at(data))
+    if key == data['id'] and data.get('title'):
+        suggestion_index.add(data['id'], data['title'], data.get('duration'), played=True)
+
+# Search suggestions
+# /play autocompletes from an in-memory trigram index over resolved titles and
+# recent Invidious search results. Choosing a suggestion passes its video id
+# so playback skips the search round trip.
+SUGGEST_INDEX_SIZE = int(os.environ.get('SUGGEST_INDEX_SIZE', 20000))
+SUGGEST_MIN_LOCAL = int(os.environ.get('SUGGEST_MIN_LOCAL', 5))  # Fewer local matches than this triggers a search
+SUGGEST_SEARCH_TIMEOUT = float(os.environ.get('SUGGEST_SEARCH_TIMEOUT', 1.5))  # Keeps inside Discord's 3s window
+SUGGEST_SEARCH_TTL = int(os.environ.get('SUGGEST_SEARCH_TTL', 600))  # Seconds before the same text is searched again
+SUGGESTION_PREFIX = 'yt:'
+MAX_CHOICES = 25
+
+def normalize_title(text):
+    # Keep combining marks so Thai vowels and tones stay inside their word
+    return " ".join("".join(c if c.isalnum() or unicodedata.category(c).startswith('M') else " "
+                            for c in text.casefold()).split())
+
+def title_grams(normalized):
+    grams = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def query_grams(words):
+    """Grams a title must contain: substrings for long words, word starts for short ones"""
+    grams = set()
+    for word in words:
+        if len(word) < 3:
+            word = f"  {word}"[-3:]
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+class SuggestionIndex:
+    """Bounded title index; most recently seen videos survive eviction"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # video_id -> [title, duration, plays, normalized title]
+        self.grams = {}  # trigram -> video ids
+
+    def add(self, video_id, title, duration=0, *, played=False):
+        entry = self.entries.get(video_id)
+        if entry is None:
+            normalized = normalize_title(title)
+            entry = self.entries[video_id] = [title, duration or 0, 0, normalized]
+            for gram in title_grams(normalized):
+                self.grams.setdefault(gram, set()).add(video_id)
+            while len(self.entries) > self.maxsize:
+                self._drop(*self.entries.popitem(last=False))
+        else:
+            self.entries.move_to_end(video_id)
+        if played:
+            entry[2] += 1
+
+    def _drop(self, video_id, entry):
+        for gram in title_grams(entry[3]):
+            ids = self.grams.get(gram)
+            if ids is not None:
+                ids.discard(video_id)
+                if not ids:
+                    del self.grams[gram]
+
+    def get(self, video_id):
+        return self.entries.get(video_id)
+
+    def search(self, text, limit=MAX_CHOICES):
+        """(video_id, title, duration) matching every word, best first"""
+        normalized = normalize_title(text)
+        words = normalized.split()
+        if not words:
+            recent = itertools.islice(reversed(self.entries.items()), limit)
+            return [(video_id, entry[0], entry[1]) for video_id, entry in recent]
+        
+        id_sets = []
+        for gram in query_grams(words):
+            ids = self.grams.get(gram)
+            if not ids:
+                return []
+            id_sets.append(ids)
+        id_sets.sort(key=len)
+        candidates = id_sets[0].intersection(*id_sets[1:])
+        
+        matches = []
+        for video_id in candidates:
+            title, duration, plays, title_text = self.entries[video_id]
+            # Grams can match out of order; check the words really appear
+            if all(word in title_text if len(word) >= 3 else f" {word}" in f" {title_text}" for word in words):
+                matches.append(((title_text.startswith(normalized), plays), video_id, title, duration))
+        best = heapq.nlargest(limit, matches, key=itemgetter(0))
+        return [(video_id, title, duration) for _, video_id, title, duration in best]
+
+suggestion_index = SuggestionIndex(SUGGEST_INDEX_SIZE)
+recent_searches = OrderedDict()  # normalized text -> when it was searched
+
+for cached, _ in list(stream_cache.entries.values()):
+    if (cached.get('extractor_key') or 'Youtube') == 'Youtube' and cached.get('title'):
+        suggestion_index.add(cached['id'], cached['title'], cached.get('duration'))
+
+def suggestion_video_id(value):
+    """The video id carried by a chosen suggestion, if the value is one"""
+    if not value.startswith(SUGGESTION_PREFIX):
+        return None
+    video_id = value[len(SUGGESTION_PREFIX):]
+    if len(video_id) != 11 or not all(c.isalnum() or c in '-_' for c in video_id):
+        return None
+    return video_id
+
+async def search_suggestions(text):
+    """Top up the index from the healthiest Invidious instance; True if anything was added"""
+    key = normalize_title(text)
+    searched = recent_searches.get(key)
+    if searched is not None and time.monotonic() - searched < SUGGEST_SEARCH_TTL:
+        return False
     
-    # Use LARGE image instead of small thumbnail
-    if show_large_image:
-        embed.set_image(url=LARGE_IMAGE_URL)
+    instances = ranked_instances()
+    if not instances:
+        return False
+    try:
+        with track_stage('suggest_search'):
+            results = await asyncio.wait_for(
+                search_instance(get_http_session(), instances[0].url, text), SUGGEST_SEARCH_TIMEOUT)
+    except Exception as e:
+        print(f"Suggestion search failed: {e!r}")
+        return False
     
-    embed.set_footer(text="Music Bot • Made with ❤️")
+    # Only remember successful searches; a failed one may be retried on the next keystroke
+    recent_searches[key] = time.monotonic()
+    recent_searches.move_to_end(key)
+    while len(recent_searches) > 1000:
+        recent_searches.popitem(last=False)
+    return bool(results)
+
+# Embed creation function with LARGE IMAGE
+# Shared parts of every embed are built once per (color, image) and cloned;
+# the nested dicts are shared between clones and must never be mutated.
+embed_templates = {}
+
+def embed_template(color, show_large_image):
+    key = (color, show_large_image)
+    template = embed_templates.get(key)
+    if template is None:
+        template = {'type': 'rich', 'color': color, 'footer': {'text': "Music Bot • Made with ❤️"}}
+        # Use LARGE image instead of small thumbnail
+        if show_large_image:
+            template['image'] = {'url': LARGE_IMAGE_URL}
+        embed_templates[key] = template
+    return template
+
+def create_embed(title, description, color=0x00ff00, show_large_image=True):
+    """Create embed message with LARGE image (not thumbnail)"""
+    embed = discord.Embed.from_dict({**embed_template(color, show_large_image), 'title': title, 'description': description})
+    embed.timestamp = discord.utils.utcnow()
     return embed
 
+# Replies
+# Sends wait on a client-side copy of Discord's per-channel rate limit, and
+# bursts of "added to queue" replies in one channel are merged into one embed.
+CHANNEL_RATE_LIMIT = int(os.environ.get('CHANNEL_RATE_LIMIT', 5))  # Messages per period
+CHANNEL_RATE_PERIOD = float(os.environ.get('CHANNEL_RATE_PERIOD', 5.0))
+REPLY_COALESCE_WINDOW = float(os.environ.get('REPLY_COALESCE_WINDOW', 1.5))  # 0 disables merging
+
+class ChannelBucket:
+    """Tracks recent sends to one channel and waits before exceeding the limit"""
+    def __init__(self):
+        self.sent = deque()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            while self.sent and now - self.sent[0] >= CHANNEL_RATE_PERIOD:
+                self.sent.popleft()
+            if len(self.sent) >= CHANNEL_RATE_LIMIT:
+                await asyncio.sleep(CHANNEL_RATE_PERIOD - (now - self.sent.popleft()))
+            self.sent.append(time.monotonic())
+
+channel_buckets = {}
+pending_queue_replies = {}  # channel id -> [(title, position)]
+
+def channel_bucket(channel_id):
+    bucket = channel_buckets.get(channel_id)
+    if bucket is None:
+        bucket = channel_buckets[channel_id] = ChannelBucket()
+    return bucket
+
+async def reply(ctx, embed):
+    """Send an embed to the command's channel without tripping its rate limit"""
+    await channel_bucket(ctx.channel.id).acquire()
+    return await ctx.send(embed=embed)
+
+async def reply_queued(ctx, title, position):
+    """Report an enqueued track, merged with others added around the same time"""
+    # A slash command must get its own response, so it is never merged
+    if REPLY_COALESCE_WINDOW <= 0 or ctx.interaction is not None:
+        embed = create_embed("✅ เพิ่มเพลงในคิวแล้ว", f"**{title}**\n\nตำแหน่งในคิว: #{position}")
+        await reply(ctx, embed)
+        return
+    entries = pending_queue_replies.get(ctx.channel.id)
+    if entries is not None:
+        entries.append((title, position))
+        return
+    pending_queue_replies[ctx.channel.id] = [(title, position)]
+    bot.loop.create_task(flush_queued_replies(ctx))
+
+async def flush_queued_replies(ctx):
+    await asyncio.sleep(REPLY_COALESCE_WINDOW)
+    # Anything added while waiting on the bucket still joins this message
+    await channel_bucket(ctx.channel.id).acquire()
+    entries = pending_queue_replies.pop(ctx.channel.id, [])
+    if len(entries) == 1:
+        title, position = entries[0]
+        embed = create_embed("✅ เพิ่มเพลงในคิวแล้ว", f"**{title}**\n\nตำแหน่งในคิว: #{position}")
+    else:
+        lines = "\n".join(f"**#{position}** {title}" for title, position in entries[:15])
+        if len(entries) > 15:
+            lines += f"\n...และอีก {len(entries) - 15} เพลง"
+        embed = create_embed(f"✅ เพิ่ม {len(entries)} เพลงในคิวแล้ว", lines)
+    try:
+        await ctx.send(embed=embed)
+    except discord.HTTPException as e:
+        print(f"Failed to send queue reply: {e}")
+
 # Enhanced Invidious API with multiple instances and retries
-async def get_youtube_audio_url(query):
-    """Use Invidious API to avoid yt-dlp issues with multiple instances"""
-    invidious_instances = [
+INVIDIOUS_INSTANCES = [
+    url.strip().rstrip('/') for url in os.environ.get('INVIDIOUS_INSTANCES', ",".join([
         "https://vid.puffyan.us",
-        "https://inv.riverside.rocks", 
+        "https://inv.riverside.rocks",
         "https://yt.artemislena.eu",
         "https://invidious.snopyta.org",
         "https://yewtu.be",
         "https://invidious.weblibre.org",
         "https://invidious.esmailelbob.xyz",
         "https://inv.bp.projectsegfau.lt"
-    ]
+    ])).split(",") if url.strip()
+]
+INVIDIOUS_PARALLEL = int(os.environ.get('INVIDIOUS_PARALLEL', 3))  # Max instances queried at once
+INVIDIOUS_HEDGE_DELAY = float(os.environ.get('INVIDIOUS_HEDGE_DELAY', 0.75))  # Seconds before starting the next instance
+INVIDIOUS_TIMEOUT = float(os.environ.get('INVIDIOUS_TIMEOUT', 10))  # Per-instance timeout
+INVIDIOUS_BENCH_AFTER = int(os.environ.get('INVIDIOUS_BENCH_AFTER', 3))  # Consecutive failures before benching
+INVIDIOUS_BENCH_SECONDS = int(os.environ.get('INVIDIOUS_BENCH_SECONDS', 60))
+INVIDIOUS_BENCH_MAX = int(os.environ.get('INVIDIOUS_BENCH_MAX', 1800))
+HEALTH_DECAY = 0.3  # Weight of the newest sample in rolling averages
+
+class InstanceHealth:
+    """Rolling latency/error score for one Invidious instance"""
+    __slots__ = ('url', 'latency', 'error_rate', 'successes', 'failures', 'consecutive_failures', 'benched_until')
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.benched_until = 0
+
+    def record_success(self, elapsed):
+        self.latency = elapsed if self.latency is None else self.latency + HEALTH_DECAY * (elapsed - self.latency)
+        self.error_rate -= HEALTH_DECAY * self.error_rate
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.benched_until = 0
+
+    def record_failure(self):
+        self.error_rate += HEALTH_DECAY * (1 - self.error_rate)
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= INVIDIOUS_BENCH_AFTER:
+            backoff = INVIDIOUS_BENCH_SECONDS * 2 ** (self.consecutive_failures - INVIDIOUS_BENCH_AFTER)
+            self.benched_until = time.time() + min(backoff, INVIDIOUS_BENCH_MAX)
+
+    def is_benched(self):
+        return time.time() < self.benched_until
+
+    def score(self):
+        """Lower is better; untried instances get a neutral latency guess"""
+        latency = self.latency if self.latency is not None else INVIDIOUS_TIMEOUT / 4
+        return latency * (1 + 4 * self.error_rate)
+
+    def describe(self):
+        latency = f"{self.latency * 1000:.0f}ms" if self.latency is not None else "-"
+        state = "⛔" if self.is_benched() else "✅"
+        return f"{state} `{urlparse(self.url).netloc}` {latency} • ผิดพลาด {self.error_rate:.0%}"
+
+instance_health = {url: InstanceHealth(url) for url in INVIDIOUS_INSTANCES}
+
+def ranked_instances():
+    """Healthy instances by score, benched ones last as a final resort"""
+    healthy = [h for h in instance_health.values() if not h.is_benched()]
+    benched = [h for h in instance_health.values() if h.is_benched()]
+    healthy.sort(key=lambda h: (h.score(), random.random()))
+    benched.sort(key=lambda h: h.benched_until)
+    return healthy + benched
+
+async def search_instance(session, instance, query):
+    """Search one Invidious instance, adding the results to the suggestion index"""
+    async with session.get(f"{instance}/api/v1/search", params={'q': query, 'type': 'video'}) as resp:
+        if resp.status != 200:
+            raise Exception(f"search returned HTTP {resp.status}")
+        results = [item for item in await resp.json() if item.get('videoId')]
+    for item in results:
+        if item.get('title'):
+            suggestion_index.add(item['videoId'], item['title'], item.get('lengthSeconds'))
+    return results
+
+async def fetch_from_instance(session, instance, query, video_id=None):
+    """Look up a video on one Invidious instance, raising on any failure"""
+    found_id = video_id
+    if not found_id:
+        # Search for video
+        search_data = await search_instance(session, instance, query)
+        if not search_data:
+            raise Exception("search returned no results")
+        # Get first result
+        found_id = search_data[0]['videoId']
+    
+    # Get video info
+    async with session.get(f"{instance}/api/v1/videos/{found_id}") as video_resp:
+        if video_resp.status != 200:
+            raise Exception(f"video lookup returned HTTP {video_resp.status}")
+        video_data = await video_resp.json()
+    
+    # Find best audio stream
+    best_audio = None
+    def rank(format):
+        # Prefer Opus in passthrough mode so FFmpeg can copy it untouched
+        return (OPUS_PASSTHROUGH and 'opus' in format.get('type', ''), int(format.get('bitrate', 0)))
     
-    # Shuffle instances to distribute load
-    random.shuffle(invidious_instances)
+    for format in video_data.get('adaptiveFormats', []):
+        if 'audio' in format.get('type', '') and format.get('url'):
+            if not best_audio or rank(format) > rank(best_audio):
+                best_audio = format
+    
+    if not best_audio:
+        raise Exception("no audio stream available")
+    return {
+        'id': found_id,
+        'url': best_audio['url'],
+        'acodec': best_audio.get('encoding') or ('opus' if 'opus' in best_audio.get('type', '') else None),
+        'title': video_data['title'],
+        'duration': video_data.get('duration', 0),
+        'webpage_url': f"https://youtube.com/watch?v={found_id}",
+        'instance': instance
+    }
+
+async def get_youtube_audio_url(query, video_id=None):
+    """Use Invidious API, hedging across the healthiest instances"""
+    session = get_http_session()
     
-    for instance in invidious_instances:
+    async def attempt(health):
+        start = time.perf_counter()
         try:
-            timeout = aiohttp.ClientTimeout(total=30)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                # Search for video
-                async with session.get(f"{instance}/api/v1/search?q={query}&type=video") as resp:
-                    if resp.status == 200:
-                        search_data = await resp.json()
-                        if search_data and len(search_data) > 0:
-                            # Get first result
-                            video_id = search_data[0]['videoId']
-                            
-                            # Get video info with timeout
-                            async with session.get(f"{instance}/api/v1/videos/{video_id}") as video_resp:
-                                if video_resp.status == 200:
-                                    video_data = await video_resp.json()
-                                    
-                                    # Find best audio stream
-                                    best_audio = None
-                                    for format in video_data.get('adaptiveFormats', []):
-                                        if 'audio' in format.get('type', '') and format.get('url'):
-                                            if not best_audio or format.get('bitrate', 0) > best_audio.get('bitrate', 0):
-                                                best_audio = format
-                                    
-                                    if best_audio:
-                                        return {
-                                            'url': best_audio['url'],
-                                            'title': video_data['title'],
-                                            'duration': video_data.get('duration', 0),
-                                            'webpage_url': f"https://youtube.com/watch?v={video_id}",
-                                            'instance': instance
-                                        }
+            data = await asyncio.wait_for(fetch_from_instance(session, health.url, query, video_id), INVIDIOUS_TIMEOUT)
+        except asyncio.CancelledError:
+            instance_results.inc(instance=health.url, result='cancelled')
+            raise
         except Exception as e:
-            print(f"Invidious instance {instance} failed: {e}")
-            continue
+            health.record_failure()
+            instance_results.inc(instance=health.url, result='error')
+            instance_latency.observe(time.perf_counter() - start, instance=health.url)
+            print(f"Invidious instance {health.url} failed: {e!r}")
+            return None
+        elapsed = time.perf_counter() - start
+        health.record_success(elapsed)
+        instance_results.inc(instance=health.url, result='ok')
+        instance_latency.observe(elapsed, instance=health.url)
+        return data
+    
+    # Start the best instance, then add another whenever one fails or the
+    # hedge delay passes, keeping at most INVIDIOUS_PARALLEL in flight.
+    remaining = ranked_instances()
+    pending = set()
+    try:
+        with stage_latency.time(stage='invidious_lookup'):
+            while remaining or pending:
+                if remaining and len(pending) < INVIDIOUS_PARALLEL:
+                    pending.add(asyncio.create_task(attempt(remaining.pop(0))))
+                can_hedge = remaining and len(pending) < INVIDIOUS_PARALLEL
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=INVIDIOUS_HEDGE_DELAY if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    data = task.result()
+                    if data:
+                        return data
+    finally:
+        for task in pending:
+            task.cancel()
     
     return None
 
 # Audio source classes
-class YTDLSource(discord.PCMVolumeTransformer):
+class PlaybackClock:
+    """Counts frames read by the voice thread to track playback position"""
+    FRAME_SECONDS = 0.02  # discord.py reads 20ms of audio per frame
+    frames = 0
+    started_at = None  # Set when handed to the voice client
+
+    def read(self):
+        self.frames += 1
+        if self.frames == 1 and self.started_at is not None:
+            stage_latency.observe(time.perf_counter() - self.started_at, stage='ffmpeg_first_frame')
+        return super().read()
+
+    @property
+    def elapsed(self):
+        """Seconds of audio actually played (pauses excluded)"""
+        return self.frames * self.FRAME_SECONDS
+
+class MusicSource(PlaybackClock, discord.PCMVolumeTransformer):
+    """Volume-controlled source that counts played frames"""
+
+class OpusSource(PlaybackClock, discord.FFmpegOpusAudio):
+    """Opus packets straight from FFmpeg, copied when the stream is already Opus"""
+    def __init__(self, url, *, data, volume=1.0, start_at=0):
+        base_options = ffmpeg_options_for(data, start_at)
+        options = base_options['options']
+        if volume != 1.0:
+            options = f"{options} -filter:a volume={volume:.2f}"
+        self.passthrough = volume == 1.0 and data.get('acodec') == 'opus'
+        super().__init__(url, codec='copy' if self.passthrough else None,
+                         before_options=base_options['before_options'], options=options)
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('webpage_url')
+        self.volume = volume  # Fixed for the life of the source
+
+class YTDLSource(MusicSource):
     def __init__(self, source, *, data, volume=0.5):
         super().__init__(source, volume)
         self.data = data
@@ -173,18 +1174,34 @@ class YTDLSource(discord.PCMVolumeTransformer):
         self.url = data.get('url')
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
+    async def extract(cls, url, *, loop=None):
+        """Resolve stream metadata without starting FFmpeg"""
         loop = loop or asyncio.get_event_loop()
-        ytdl = get_current_ytdl()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+        target = url
+        known = query_cache.get(query_cache_key(url))
+        if known:
+            cached = stream_cache.get(known['key'])
+            if cached:
+                return cached
+            target = known.get('webpage_url') or url
         
-        if 'entries' in data:
-            data = data['entries'][0]
+        with track_stage('ytdl_extract'):
+            data, _ = await extract_info(target, loop=loop)
+        remember_resolution(url, data)
+        return data
+
+    @classmethod
+    async def from_url(cls, url, *, loop=None, stream=False):
+        loop = loop or asyncio.get_event_loop()
+        if stream:
+            data = await cls.extract(url, loop=loop)
+            return cls(discord.FFmpegPCMAudio(data['url'], **ffmpeg_options), data=data)
         
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
+        with track_stage('ytdl_download'):
+            data, filename = await extract_info(url, download=True, loop=loop)
         return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
 
-class InvidiousSource(discord.PCMVolumeTransformer):
+class InvidiousSource(MusicSource):
     def __init__(self, source, *, data, volume=0.5):
         super().__init__(source, volume)
         self.data = data
@@ -192,22 +1209,928 @@ class InvidiousSource(discord.PCMVolumeTransformer):
         self.url = data.get('webpage_url')
 
     @classmethod
-    async def from_query(cls, query, *, loop=None):
-        loop = loop or asyncio.get_event_loop()
-        data = await get_youtube_audio_url(query)
+    async def fetch(cls, query, *, video_id=None):
+        """Resolve stream metadata without starting FFmpeg"""
+        if not video_id:
+            known = query_cache.get(query_cache_key(query))
+            if known and known['key'] == known['id']:
+                video_id = known['id']
+        if video_id:
+            cached = stream_cache.get(video_id)
+            if cached:
+                return cached
         
-        if not data:
-            raise Exception("Cannot fetch music data from Invidious")
+        with track_stage('invidious_resolve'):
+            data = await get_youtube_audio_url(query, video_id=video_id)
+            
+            if not data:
+                raise Exception("Cannot fetch music data from Invidious")
+        remember_resolution(query, data)
+        return data
+
+    @classmethod
+    async def from_query(cls, query, *, loop=None):
+        data = await cls.fetch(query)
+        return cls(discord.FFmpegPCMAudio(data['url'], **ffmpeg_options), data=data)
+
+# Lazy queue entries
+# Queues hold Track descriptors; stream URLs are resolved and FFmpeg is only
+# spawned shortly before a track plays.
+PREFETCH_TRACKS = int(os.environ.get('PREFETCH_TRACKS', 2))  # Tracks ahead to resolve early
+PREWARM_SECONDS = float(os.environ.get('PREWARM_SECONDS', 10))  # Open the next FFmpeg pipeline this early; 0 disables
+STREAM_URL_MAX_AGE = int(os.environ.get('STREAM_URL_MAX_AGE', 1800))  # Seconds before re-resolving
+VOICE_RETRY_SECONDS = float(os.environ.get('VOICE_RETRY_SECONDS', 1))  # Poll interval while voice is unavailable
+
+class Track:
+    """Lightweight queue entry (no FFmpeg process until played)"""
+    __slots__ = ('query', 'video_id', 'title', 'duration', 'method', 'start_at', 'data', 'expires_at', 'prefetch_task')
+
+    def __init__(self, query, *, video_id=None, title=None, duration=0, method="invidious", start_at=0):
+        self.query = query
+        self.video_id = video_id
+        self.title = title or query
+        self.duration = duration or 0
+        self.method = method
+        self.start_at = start_at  # Seconds to seek into the track (resumed sessions)
+        self.data = None
+        self.expires_at = 0
+        self.prefetch_task = None
+
+    @classmethod
+    def from_data(cls, query, data, method):
+        track = cls(
+            data.get('webpage_url') or query,
+            video_id=data.get('id'),
+            title=data.get('title'),
+            duration=data.get('duration'),
+            method=method,
+        )
+        track.set_data(data)
+        return track
+
+    def set_data(self, data):
+        self.data = data
+        self.expires_at = min(time.time() + STREAM_URL_MAX_AGE, stream_expires_at(data))
+
+    def is_resolved(self):
+        return self.data is not None and time.time() < self.expires_at
+
+    def release(self):
+        """Drop resolved stream data so idle entries stay small"""
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+        self.data = None
+        self.expires_at = 0
+
+# Local audio cache
+# Tracks played AUDIO_CACHE_MIN_PLAYS times are downloaded in the background
+# and then served from disk instead of being re-streamed.
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR', 'audio_cache')
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MAX_MB', 2048)) * 1024 * 1024  # 0 disables
+AUDIO_CACHE_MIN_PLAYS = int(os.environ.get('AUDIO_CACHE_MIN_PLAYS', 3))
+AUDIO_CACHE_POLICY = os.environ.get('AUDIO_CACHE_POLICY', 'lru')  # "lru" or "lfu"
+AUDIO_CACHE_DOWNLOADS = int(os.environ.get('AUDIO_CACHE_DOWNLOADS', 1))  # Concurrent background downloads
+AUDIO_CACHE_MAX_ENTRIES = int(os.environ.get('AUDIO_CACHE_MAX_ENTRIES', 50000))  # Play counts kept in memory
+
+class CachedAudio:
+    __slots__ = ('key', 'filename', 'size', 'acodec', 'plays', 'last_played')
+
+    def __init__(self, key, filename=None, size=0, acodec=None, plays=0, last_played=0):
+        self.key = key
+        self.filename = filename
+        self.size = size
+        self.acodec = acodec
+        self.plays = plays
+        self.last_played = last_played
+
+class AudioCache:
+    """Play counts plus a size-capped directory of downloaded tracks"""
+    def __init__(self, directory, max_bytes, *, db=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.db = db
+        self.entries = OrderedDict()  # Least recently played first
+        self.total_bytes = 0
+        self.downloading = set()
+        self.download_slots = None
+        if db:
+            self._load()
+        if self.enabled():
+            self._scan()
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _load(self):
+        try:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS audio_cache ("
+                "key TEXT PRIMARY KEY, filename TEXT, size INTEGER, acodec TEXT, plays INTEGER, last_played REAL)"
+            )
+            # Forget play counts for tracks nobody has played in a month
+            self.db.execute("DELETE FROM audio_cache WHERE filename IS NULL AND last_played < ?",
+                            (time.time() - 30 * 24 * 3600,))
+            rows = self.db.execute(
+                "SELECT key, filename, size, acodec, plays, last_played FROM audio_cache ORDER BY last_played"
+            ).fetchall()
+            self.db.commit()
+        except sqlite3.Error as e:
+            print(f"Failed to load audio cache index: {e}")
+            return
+        for row in rows:
+            entry = CachedAudio(*row)
+            if entry.filename and not os.path.exists(entry.filename):
+                entry.filename, entry.size = None, 0
+                self._save(entry)
+            self.entries[entry.key] = entry
+            self.total_bytes += entry.size
+        self.forget_stale()
+
+    def _scan(self):
+        """Count files already on disk that the index does not know about
+
+        Without a database (or after a crash between download and save) the
+        files would otherwise never be counted against max_bytes or evicted.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        indexed = {entry.filename for entry in self.entries.values() if entry.filename}
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path in indexed or not os.path.isfile(path):
+                continue
+            key, ext = os.path.splitext(name)
+            try:
+                if ext in ('.part', '.ytdl') or '.part-' in name:
+                    os.remove(path)  # Interrupted download
+                    continue
+                entry = self.entries.get(key)
+                if entry is not None and entry.filename:
+                    os.remove(path)  # Same track in another format
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if entry is None:
+                entry = self.entries[key] = CachedAudio(key, last_played=stat.st_mtime)
+            entry.filename = path
+            entry.size = stat.st_size
+            entry.acodec = 'opus' if ext == '.opus' else None  # Unknown codecs get transcoded
+            self.total_bytes += entry.size
+            self._save(entry)
+        self.evict()
+
+    def _save(self, entry):
+        if self.db:
+            cache_writer.write(
+                "INSERT OR REPLACE INTO audio_cache (key, filename, size, acodec, plays, last_played) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.key, entry.filename, entry.size, entry.acodec, entry.plays, entry.last_played)
+            )
+
+    def forget_stale(self):
+        """Drop play counts of the least recently played uncached tracks, down to 90% of the limit"""
+        excess = len(self.entries) - AUDIO_CACHE_MAX_ENTRIES
+        if excess <= 0:
+            return
+        excess += AUDIO_CACHE_MAX_ENTRIES // 10  # Trim in chunks so this scan stays rare
+        for key, entry in list(self.entries.items()):
+            if excess <= 0:
+                break
+            if entry.filename or key in self.downloading:
+                continue
+            del self.entries[key]
+            if self.db:
+                cache_writer.write("DELETE FROM audio_cache WHERE key = ?", (key,))
+            excess -= 1
+
+    def lookup(self, key):
+        """Local file data for a cached track, or None"""
+        entry = self.entries.get(key)
+        if not entry or not entry.filename:
+            return None
+        if not os.path.exists(entry.filename):
+            self.total_bytes -= entry.size
+            entry.filename, entry.size = None, 0
+            self._save(entry)
+            return None
+        return {'id': key, 'url': entry.filename, 'acodec': entry.acodec, 'local': True}
+
+    def record_play(self, track):
+        """Count a play and start a background download once the track is popular"""
+        if not self.enabled() or not track.video_id:
+            return
+        key = track.video_id
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = CachedAudio(key)
+            self.forget_stale()
+        else:
+            self.entries.move_to_end(key)
+        entry.plays += 1
+        entry.last_played = time.time()
+        self._save(entry)
         
-        filename = data['url']
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+        if entry.filename or entry.plays < AUDIO_CACHE_MIN_PLAYS or key in self.downloading:
+            return
+        url = track.query
+        if not url.startswith(('http://', 'https://')):
+            url = f"https://www.youtube.com/watch?v={key}"
+        self.downloading.add(key)
+        bot.loop.create_task(self.download(entry, url))
+
+    async def download(self, entry, url):
+        if self.download_slots is None:
+            self.download_slots = asyncio.Semaphore(AUDIO_CACHE_DOWNLOADS)
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.download_slots:
+                os.makedirs(self.directory, exist_ok=True)
+                filename, acodec = await loop.run_in_executor(
+                    get_ytdl_executor(), run_cache_download, current_ytdl_config, url, self.directory
+                )
+            entry.filename = filename
+            entry.size = os.path.getsize(filename)
+            entry.acodec = acodec
+            self.total_bytes += entry.size
+            self._save(entry)
+            print(f"🎧 Cached {entry.key} ({entry.size // 1024} KiB)")
+            self.evict()
+        except Exception as e:
+            print(f"Audio cache download failed for {entry.key}: {e}")
+        finally:
+            self.downloading.discard(entry.key)
+
+    def evict(self):
+        """Delete cached files until the cache fits in max_bytes"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        order = attrgetter('plays', 'last_played') if AUDIO_CACHE_POLICY == 'lfu' else attrgetter('last_played')
+        for entry in sorted((e for e in self.entries.values() if e.filename), key=order):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(entry.filename)
+            except OSError:
+                pass
+            self.total_bytes -= entry.size
+            entry.filename, entry.size = None, 0
+            self._save(entry)
+
+    def stats(self):
+        files = sum(1 for e in self.entries.values() if e.filename)
+        return f"{files} ไฟล์ • {self.total_bytes / 1048576:.0f}/{self.max_bytes / 1048576:.0f} MB"
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, db=cache_db)
+
+async def resolve_track(track, *, loop=None):
+    """Fetch a fresh stream URL for a queued track"""
+    if track.is_resolved():
+        return track.data
+    
+    if track.video_id:
+        local = audio_cache.lookup(track.video_id)
+        if local:
+            track.set_data({**local, 'title': track.title, 'duration': track.duration})
+            return track.data
+    
+    if track.method == "invidious":
+        try:
+            data = await InvidiousSource.fetch(track.query, video_id=track.video_id)
+        except Exception as e:
+            print(f"Invidious resolve failed for {track.title}: {e}")
+            data = await YTDLSource.extract(track.query, loop=loop)
+            track.method = "ytdl"
+    else:
+        try:
+            data = await YTDLSource.extract(track.query, loop=loop)
+        except Exception as e:
+            print(f"yt-dlp resolve failed for {track.title}: {e}")
+            data = await InvidiousSource.fetch(track.query, video_id=track.video_id)
+            track.method = "invidious"
+    
+    track.set_data(data)
+    return data
+
+def ffmpeg_options_for(data, start_at=0):
+    """Local cache files don't take the HTTP reconnect flags; resumed tracks seek"""
+    before_options = '' if data.get('local') else ffmpeg_options['before_options']
+    if start_at:
+        before_options = f"-ss {start_at:.2f} {before_options}".strip()
+    return {**ffmpeg_options, 'before_options': before_options}
+
+def create_source(track, volume=DEFAULT_VOLUME):
+    """Spawn the FFmpeg source for a resolved track"""
+    with track_stage('ffmpeg_spawn'):
+        if OPUS_PASSTHROUGH:
+            return OpusSource(track.data['url'], data=track.data, volume=volume, start_at=track.start_at)
+        source = discord.FFmpegPCMAudio(track.data['url'], **ffmpeg_options_for(track.data, track.start_at))
+    if track.method == "invidious":
+        return InvidiousSource(source, data=track.data, volume=volume)
+    return YTDLSource(source, data=track.data, volume=volume)
+
+async def prefetch_track(track):
+    try:
+        await resolve_track(track, loop=bot.loop)
+    except Exception as e:
+        print(f"Prefetch failed for {track.title}: {e}")
 
 # Queue management
-def check_queue(ctx, guild_id):
-    if queues.get(guild_id):
-        if len(queues[guild_id]) > 0:
-            source = queues[guild_id].pop(0)
-            ctx.voice_client.play(source, after=lambda x=None: check_queue(ctx, guild_id))
+class TrackQueue(asyncio.Queue):
+    """asyncio.Queue of Track entries with positional management
+
+    Backed by the deque asyncio.Queue already keeps: push/pop at either end
+    is O(1), and positions are 0-based indexes into that deque.
+    """
+    version = 0  # Bumped on every change so snapshots can skip unchanged queues
+
+    def _put(self, item):
+        self.version += 1
+        super()._put(item)
+
+    def _get(self):
+        self.version += 1
+        return super()._get()
+
+    def __iter__(self):
+        return iter(self._queue)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def peek(self, count):
+        return list(itertools.islice(self._queue, count))
+
+    def page(self, start, count):
+        """Tracks at [start, start + count) without walking the rest of the queue"""
+        end = min(start + count, len(self._queue))
+        return [self._queue[index] for index in range(start, end)]
+
+    def remove(self, index):
+        self.version += 1
+        track = self._queue[index]
+        del self._queue[index]
+        self.task_done()
+        return track
+
+    def move(self, index, new_index):
+        self.version += 1
+        track = self._queue[index]
+        del self._queue[index]
+        self._queue.insert(new_index, track)
+        return track
+
+    def drop_front(self, count):
+        """Release the first count tracks"""
+        self.version += 1
+        for _ in range(min(count, len(self._queue))):
+            self._queue.popleft().release()
+            self.task_done()
+
+    def shuffle(self):
+        self.version += 1
+        tracks = list(self._queue)
+        random.shuffle(tracks)
+        self._queue.clear()
+        self._queue.extend(tracks)
+
+    def dedup(self):
+        """Drop later copies of the same song, returning how many were removed"""
+        seen = set()
+        kept = deque()
+        for track in self._queue:
+            key = track.video_id or track.query
+            if key in seen:
+                track.release()
+                self.task_done()
+            else:
+                seen.add(key)
+                kept.append(track)
+        removed = len(self._queue) - len(kept)
+        self._queue = kept
+        self.version += 1
+        return removed
+
+    def push_front(self, track):
+        self.put_nowait(track)
+        self._queue.rotate(1)  # put_nowait appended it; bring it to the front
+
+    def clear(self):
+        """Remove and release every waiting track"""
+        while not self.empty():
+            self.get_nowait().release()
+            self.task_done()
+
+transition_gaps = deque(maxlen=100)  # Recent silences between queued tracks, in seconds
+
+def gap_stats():
+    if not transition_gaps:
+        return "-"
+    average = sum(transition_gaps) / len(transition_gaps)
+    return f"เฉลี่ย {average * 1000:.0f}ms • ล่าสุด {transition_gaps[-1] * 1000:.0f}ms"
+
+class GuildPlayer:
+    """Plays one guild's queue from a single task, one track at a time"""
+    def __init__(self, guild):
+        self.guild = guild
+        self.queue = TrackQueue()
+        self.current = None
+        self.source = None
+        self.volume = DEFAULT_VOLUME
+        self.text_channel_id = None  # Where resume notices go
+        self.prewarmed = None  # (track, source) opened ahead of time
+        self.prewarm_task = None
+        self.track_done = asyncio.Event()
+        self.track_ended_at = None
+        self.generation = 0  # Bumped by clear() so in-flight opens are dropped
+        self.task = bot.loop.create_task(self.player_loop())
+
+    def position(self):
+        """Seconds into the current track, counting any resume seek"""
+        if not self.current or not self.source:
+            return 0
+        return self.current.start_at + self.source.elapsed
+
+    def is_idle(self):
+        return self.current is None and self.queue.empty()
+
+    def add(self, track):
+        """Queue a track, keeping resolved stream data only inside the prefetch window"""
+        if len(self.queue) >= PREFETCH_TRACKS:
+            track.release()
+        self.queue.put_nowait(track)
+        self.prefetch()
+        return len(self.queue)
+
+    def prefetch(self):
+        """Resolve the next PREFETCH_TRACKS entries in the background"""
+        for track in self.queue.peek(PREFETCH_TRACKS):
+            if track.is_resolved() or (track.prefetch_task and not track.prefetch_task.done()):
+                continue
+            track.prefetch_task = bot.loop.create_task(prefetch_track(track))
+
+    def on_track_end(self, error):
+        # Runs on the voice thread; hand control back to the event loop
+        if error:
+            print(f"Player error in guild {self.guild.id}: {error}")
+        self.track_ended_at = time.perf_counter()
+        bot.loop.call_soon_threadsafe(self.track_done.set)
+
+    async def prewarm_next(self, source, duration):
+        """Open the next track's pipeline shortly before the current one ends"""
+        while True:
+            remaining = duration - source.elapsed - PREWARM_SECONDS
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 5))
+        
+        upcoming = self.queue.peek(1)
+        if not upcoming:
+            return
+        track = upcoming[0]
+        try:
+            await resolve_track(track, loop=bot.loop)
+            self.prewarmed = (track, create_source(track, self.volume))
+        except Exception as e:
+            print(f"Pre-warm failed for {track.title}: {e}")
+
+    def queue_changed(self):
+        """Refresh prefetching after a reorder and re-aim pre-warming at the new next track"""
+        self.prefetch()
+        upcoming = self.queue.peek(1)
+        if self.prewarmed and (not upcoming or self.prewarmed[0] is not upcoming[0]):
+            self.restart_prewarm()
+
+    def set_volume(self, volume):
+        """Change the volume for the pre-warmed and all later tracks"""
+        self.volume = volume
+        if not self.prewarmed:
+            return
+        if isinstance(self.prewarmed[1], OpusSource):
+            # Opus volume is an FFmpeg filter fixed at spawn time
+            self.restart_prewarm()
+        else:
+            self.prewarmed[1].volume = volume
+
+    def restart_prewarm(self):
+        """Drop the pre-warmed pipeline and pre-warm the next track again"""
+        self.discard_prewarmed()
+        if self.current and self.source and PREWARM_SECONDS > 0 and self.current.duration:
+            remaining = self.current.duration - self.current.start_at
+            self.prewarm_task = bot.loop.create_task(self.prewarm_next(self.source, remaining))
+
+    def discard_prewarmed(self):
+        if self.prewarm_task and not self.prewarm_task.done():
+            self.prewarm_task.cancel()
+        self.prewarm_task = None
+        if self.prewarmed:
+            self.prewarmed[1].cleanup()
+            self.prewarmed = None
+
+    async def open_source(self, track):
+        """Use the pre-warmed pipeline if it belongs to this track"""
+        if self.prewarmed and self.prewarmed[0] is track:
+            source = self.prewarmed[1]
+            self.prewarmed = None
+            return source
+        self.discard_prewarmed()
+        await resolve_track(track, loop=bot.loop)
+        return create_source(track, self.volume)
+
+    async def player_loop(self):
+        while True:
+            track = await self.queue.get()
+            self.queue.task_done()
+            requeued = False
+            try:
+                requeued = await self.play_track(track)
+            except Exception as e:
+                # One bad track must not end the guild's player
+                print(f"Player error in guild {self.guild.id} on {track.title}: {e}")
+                stage_results.inc(stage='track_skipped', result='error')
+                if self.source is not None:
+                    self.source.cleanup()
+            finally:
+                if self.prewarm_task and not self.prewarm_task.done():
+                    self.prewarm_task.cancel()
+                self.current = None
+                self.source = None
+                if not requeued:
+                    track.release()
+                if self.queue.empty():
+                    # Only time transitions between queued tracks
+                    self.track_ended_at = None
+
+    def voice_ready(self):
+        voice_client = self.guild.voice_client
+        return voice_client is not None and voice_client.is_connected()
+
+    async def wait_for_voice(self):
+        """Hold the queue while voice is disconnected or reconnecting"""
+        while not self.voice_ready():
+            await asyncio.sleep(VOICE_RETRY_SECONDS)
+
+    def requeue(self, track, reason):
+        """Put a track back at the front when voice was not usable"""
+        print(f"Holding {track.title} in guild {self.guild.id}: {reason}")
+        stage_results.inc(stage='track_requeued', result='voice_unavailable')
+        self.queue.push_front(track)
+        return True
+
+    async def play_track(self, track):
+        """Open and play one track, returning once it has finished
+
+        Returns True if the track went back into the queue because voice
+        was unavailable, so nothing is dropped during a reconnect.
+        """
+        # Wait before resolving so a lost connection does not burn lookups
+        await self.wait_for_voice()
+        generation = self.generation
+        try:
+            source = await self.open_source(track)
+        except Exception as e:
+            print(f"Skipping {track.title}: {e}")
+            stage_results.inc(stage='track_skipped', result='error')
+            return False
+        
+        if generation != self.generation:
+            source.cleanup()
+            return False
+        if not self.voice_ready():
+            source.cleanup()
+            return self.requeue(track, "voice disconnected")
+        
+        source.started_at = time.perf_counter()
+        try:
+            self.guild.voice_client.play(source, after=self.on_track_end)
+        except discord.ClientException as e:
+            # Raised while the voice connection is reconnecting or already busy
+            source.cleanup()
+            await asyncio.sleep(VOICE_RETRY_SECONDS)
+            return self.requeue(track, e)
+        self.current = track
+        self.source = source
+        self.track_done.clear()
+        audio_cache.record_play(track)
+        if self.track_ended_at is not None:
+            gap = time.perf_counter() - self.track_ended_at
+            transition_gaps.append(gap)
+            stage_latency.observe(gap, stage='track_transition')
+            self.track_ended_at = None
+        
+        self.prefetch()
+        if PREWARM_SECONDS > 0 and track.duration:
+            self.prewarm_task = bot.loop.create_task(self.prewarm_next(source, track.duration - track.start_at))
+        await self.track_done.wait()
+        return False
+
+    def clear(self):
+        """Drop every waiting track and any pre-warmed pipeline"""
+        self.generation += 1
+        self.queue.clear()
+        self.discard_prewarmed()
+
+    def destroy(self):
+        self.task.cancel()
+        self.clear()
+
+def get_player(guild):
+    player = players.get(guild.id)
+    if player is None:
+        player = players[guild.id] = GuildPlayer(guild)
+    return player
+
+def destroy_player(guild_id):
+    player = players.pop(guild_id, None)
+    if player:
+        player.destroy()
+
+# Session persistence
+# Queues, current track position and volume are snapshotted to SQLite so a
+# restart can reconnect and resume. Only guilds whose queue changed have
+# their track rows rewritten; stream URLs are never stored.
+SESSION_DB = os.environ.get('SESSION_DB', 'sessions.db')  # Empty to disable
+SESSION_SNAPSHOT_INTERVAL = float(os.environ.get('SESSION_SNAPSHOT_INTERVAL', 10))
+RESUME_CONCURRENCY = int(os.environ.get('RESUME_CONCURRENCY', 3))  # Guilds reconnecting at once
+session_executor = None  # Single thread owning the SQLite connection
+session_db = None
+saved_sessions = {}  # guild_id -> (queue version, current track) last written
+sessions_restored = False
+
+def session_call(function, *args):
+    global session_executor
+    if session_executor is None:
+        session_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sessions')
+    return asyncio.get_running_loop().run_in_executor(session_executor, function, *args)
+
+def open_session_db():
+    global session_db
+    if session_db is None:
+        session_db = sqlite3.connect(SESSION_DB, check_same_thread=False)
+        session_db.execute("PRAGMA journal_mode=WAL")
+        session_db.execute("PRAGMA synchronous=NORMAL")
+        session_db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "guild_id INTEGER PRIMARY KEY, voice_channel_id INTEGER, text_channel_id INTEGER, "
+            "volume REAL, current TEXT, elapsed REAL, updated REAL)"
+        )
+        session_db.execute(
+            "CREATE TABLE IF NOT EXISTS session_tracks ("
+            "guild_id INTEGER, position INTEGER, track TEXT, PRIMARY KEY (guild_id, position))"
+        )
+    return session_db
+
+def track_state(track):
+    return (track.query, track.video_id, track.title, track.duration, track.method)
+
+def write_sessions(states, queues, deleted):
+    """Session thread: persist one snapshot in a single transaction"""
+    db = open_session_db()
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO sessions (guild_id, voice_channel_id, text_channel_id, volume, current, elapsed, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(*state[:4], json.dumps(state[4]) if state[4] else None, *state[5:]) for state in states]
+        )
+        for guild_id, tracks in queues.items():
+            db.execute("DELETE FROM session_tracks WHERE guild_id = ?", (guild_id,))
+            db.executemany(
+                "INSERT INTO session_tracks (guild_id, position, track) VALUES (?, ?, ?)",
+                [(guild_id, position, json.dumps(track)) for position, track in enumerate(tracks)]
+            )
+        for guild_id in deleted:
+            db.execute("DELETE FROM sessions WHERE guild_id = ?", (guild_id,))
+            db.execute("DELETE FROM session_tracks WHERE guild_id = ?", (guild_id,))
+
+def load_sessions():
+    """Session thread: every saved session that still has something to play"""
+    db = open_session_db()
+    sessions = []
+    for row in db.execute("SELECT guild_id, voice_channel_id, text_channel_id, volume, current, elapsed FROM sessions"):
+        guild_id, voice_channel_id, text_channel_id, volume, current, elapsed = row
+        tracks = [json.loads(track) for (track,) in db.execute(
+            "SELECT track FROM session_tracks WHERE guild_id = ? ORDER BY position", (guild_id,))]
+        if current or tracks:
+            sessions.append((guild_id, voice_channel_id, text_channel_id, volume,
+                             json.loads(current) if current else None, elapsed, tracks))
+    return sessions
+
+async def snapshot_sessions():
+    if not SESSION_DB:
+        return
+    states, queues = [], {}
+    for guild_id, player in list(players.items()):
+        voice_client = player.guild.voice_client
+        if voice_client is None:
+            continue
+        current = track_state(player.current) if player.current else None
+        states.append((guild_id, voice_client.channel.id, player.text_channel_id, player.volume,
+                       current, player.position(), time.time()))
+        version = (player.queue.version, id(player.current))
+        if saved_sessions.get(guild_id) != version:
+            queues[guild_id] = [track_state(track) for track in player.queue]
+            saved_sessions[guild_id] = version
+    active = {state[0] for state in states}
+    deleted = [guild_id for guild_id in saved_sessions if guild_id not in active and owns_guild(guild_id)]
+    for guild_id in deleted:
+        del saved_sessions[guild_id]
+    if states or deleted:
+        try:
+            await session_call(write_sessions, states, queues, deleted)
+        except sqlite3.Error as e:
+            print(f"Failed to save sessions: {e}")
+            saved_sessions.clear()  # Rewrite everything next time
+
+async def session_snapshot_loop():
+    while True:
+        await asyncio.sleep(SESSION_SNAPSHOT_INTERVAL)
+        await snapshot_sessions()
+
+def owns_guild(guild_id):
+    """Whether this process runs the shard the guild belongs to"""
+    shard_ids = getattr(bot, 'shard_ids', None)
+    if not shard_ids or not bot.shard_count:
+        return True
+    return (guild_id >> 22) % bot.shard_count in shard_ids
+
+async def restore_session(session, slots):
+    guild_id, voice_channel_id, text_channel_id, volume, current, elapsed, tracks = session
+    guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(voice_channel_id) if guild else None
+    if channel is None or not has_listeners(channel):
+        # Nobody left to listen; forget it on the next snapshot
+        saved_sessions[guild_id] = None
+        return
+    
+    async with slots:
+        if guild.voice_client is None:
+            try:
+                await channel.connect()
+            except Exception as e:
+                print(f"Failed to rejoin voice in guild {guild_id}: {e}")
+                saved_sessions[guild_id] = None
+                return
+    
+    player = get_player(guild)
+    player.volume = volume
+    player.text_channel_id = text_channel_id
+    if current:
+        player.queue.put_nowait(Track(current[0], video_id=current[1], title=current[2], duration=current[3],
+                                      method=current[4], start_at=elapsed or 0))
+    # Queue the rest as bare descriptors; they are resolved only as they come up
+    for query, video_id, title, duration, method in tracks:
+        player.queue.put_nowait(Track(query, video_id=video_id, title=title, duration=duration, method=method))
+    
+    text_channel = guild.get_channel(text_channel_id) if text_channel_id else None
+    if text_channel:
+        embed = create_embed("▶️ เล่นต่อ", f"กลับมาเล่นต่อจากเดิม • {len(player.queue)} เพลงในคิว", 0x00ff00)
+        try:
+            await text_channel.send(embed=embed)
+        except discord.HTTPException:
+            pass
+
+async def restore_sessions():
+    """Rejoin voice and resume every saved session, a few guilds at a time"""
+    global sessions_restored
+    if sessions_restored or not SESSION_DB:
+        return
+    sessions_restored = True
+    try:
+        sessions = await session_call(load_sessions)
+    except sqlite3.Error as e:
+        print(f"Failed to load sessions: {e}")
+        return
+    # Other shard workers share the database; leave their guilds alone
+    sessions = [session for session in sessions if owns_guild(session[0])]
+    if sessions:
+        print(f"▶️ Resuming {len(sessions)} sessions")
+    slots = asyncio.Semaphore(RESUME_CONCURRENCY)
+    await asyncio.gather(*(restore_session(session, slots) for session in sessions))
+    bot.loop.create_task(session_snapshot_loop())
+
+# Playlist ingestion
+playlist_tasks = {}  # guild_id -> background ingestion task
+
+def is_playlist_url(query):
+    """Playlist pages only; a watch?v=...&list=... link plays just that video"""
+    query = query.strip()
+    if not query.startswith(('http://', 'https://')):
+        return False
+    parsed = urlparse(query)
+    if '/playlist' in parsed.path or '/sets/' in parsed.path:
+        return True
+    params = parse_qs(parsed.query)
+    has_video = 'v' in params or (parsed.netloc.endswith('youtu.be') and parsed.path.strip('/'))
+    return 'list' in params and not has_video
+
+def iter_playlist(config_index, url, emit, stop_event):
+    """Worker: walk flat playlist entries lazily, handing them over in batches"""
+    ytdl = get_playlist_ytdl(config_index)
+    info = ytdl.extract_info(url, download=False, process=False)
+    # process=False does not follow redirects, e.g. watch?list=... -> /playlist?list=...
+    for _ in range(PLAYLIST_MAX_REDIRECTS):
+        if info.get('_type') not in ('url', 'url_transparent') or not info.get('url'):
+            break
+        info = ytdl.extract_info(info['url'], download=False, ie_key=info.get('ie_key'), process=False)
+    if not emit({'title': info.get('title')}):
+        return
+    entries = info.get('entries') or []
+    batch = []
+    first = True
+    for entry in itertools.islice(entries, PLAYLIST_MAX_TRACKS):
+        if stop_event.is_set():
+            return
+        if not entry or not (entry.get('url') or entry.get('id')):
+            continue
+        batch.append({
+            'id': entry.get('id'),
+            'url': entry.get('url') or entry.get('id'),
+            'title': entry.get('title'),
+            'duration': entry.get('duration'),
+            'ie_key': entry.get('ie_key'),
+        })
+        # Hand over the very first entry immediately so playback can start
+        if first or len(batch) >= PLAYLIST_BATCH_SIZE:
+            first = False
+            if not emit(batch):
+                return
+            batch = []
+    if batch:
+        emit(batch)
+
+async def ingest_playlist(ctx, guild_id, url):
+    """Stream playlist entries into the guild queue as they are enumerated"""
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue(maxsize=4)  # Bounded so the worker waits for us
+    stop_event = threading.Event()
+    done = object()
+    
+    def emit(item):
+        future = asyncio.run_coroutine_threadsafe(batches.put(item), loop)
+        while not stop_event.is_set():
+            try:
+                future.result(timeout=1)
+                return True
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+        return False
+    
+    def worker():
+        try:
+            iter_playlist(current_ytdl_config, url, emit, stop_event)
+        finally:
+            emit(done)
+    
+    worker_future = loop.run_in_executor(get_playlist_executor(), worker)
+    title = None
+    added = 0
+    try:
+        while True:
+            item = await batches.get()
+            if item is done:
+                break
+            if isinstance(item, dict):
+                title = item.get('title')
+                continue
+            
+            player = get_player(ctx.guild)
+            player.text_channel_id = ctx.channel.id
+            for entry in item:
+                method = current_primary_method if entry['ie_key'] in (None, 'Youtube') else "ytdl"
+                player.add(Track(entry['url'], video_id=entry['id'], title=entry['title'],
+                                 duration=entry['duration'], method=method))
+            added += len(item)
+            await asyncio.sleep(0)
+        await worker_future
+    except asyncio.CancelledError:
+        stop_event.set()
+        raise
+    except Exception as e:
+        stop_event.set()
+        print(f"Playlist ingestion failed: {e}")
+        if not added:
+            embed = create_embed("❌ เกิดข้อผิดพลาด", f"ไม่สามารถโหลดเพลย์ลิสต์ได้\n\n**ข้อความ:** {e}", 0xff0000)
+            await reply(ctx, embed)
+            return
+    finally:
+        stop_event.set()
+        if playlist_tasks.get(guild_id) is asyncio.current_task():
+            del playlist_tasks[guild_id]
+    
+    if not added:
+        embed = create_embed("❌ เกิดข้อผิดพลาด", f"ไม่พบเพลงในเพลย์ลิสต์\n\n**{title or url}**", 0xff0000)
+    else:
+        embed = create_embed("✅ เพิ่มเพลย์ลิสต์ในคิวแล้ว", f"**{title or url}**\n\nเพิ่ม {added} เพลงในคิว")
+    await reply(ctx, embed)
+
+def cancel_playlist(guild_id):
+    task = playlist_tasks.pop(guild_id, None)
+    if task and not task.done():
+        task.cancel()
 
 def rotate_method():
     """Rotate between different methods to avoid detection"""
@@ -229,13 +2152,180 @@ def rotate_method():
         last_method_switch = current_time
         print(f"🔄 Switched primary method to: {current_primary_method}")
 
+# Idle reaper
+# Disconnects voice clients that sit idle or alone, tears down their players
+# (queued tracks, pre-warmed FFmpeg pipelines, playlist ingestion) and prunes
+# reply buckets for quiet channels.
+IDLE_TIMEOUT = float(os.environ.get('IDLE_TIMEOUT', 300))  # Seconds with nothing playing; 0 disables
+EMPTY_CHANNEL_TIMEOUT = float(os.environ.get('EMPTY_CHANNEL_TIMEOUT', 60))  # Seconds with no listeners; 0 disables
+REAPER_INTERVAL = float(os.environ.get('REAPER_INTERVAL', 15))  # 0 disables the reaper
+reaped_resources = Counter('musicbot_reaped_total', "Resources reclaimed by the idle reaper")
+idle_since = {}  # guild_id -> (reason, monotonic time it was first seen)
+
+def has_listeners(channel):
+    return any(not member.bot for member in channel.members)
+
+def idle_reason(voice_client):
+    """Why a voice client could be reaped, or None while it is in use"""
+    if not has_listeners(voice_client.channel):
+        return 'empty' if EMPTY_CHANNEL_TIMEOUT > 0 else None
+    guild_id = voice_client.guild.id
+    player = players.get(guild_id)
+    if voice_client.is_playing() or guild_id in playlist_tasks:
+        return None
+    if player and not voice_client.is_paused() and not player.is_idle():
+        return None  # Between tracks
+    return 'idle' if IDLE_TIMEOUT > 0 else None
+
+def reap_player(guild_id):
+    """Destroy a guild's player and count what it was holding"""
+    cancel_playlist(guild_id)
+    player = players.get(guild_id)
+    if player is None:
+        return {}
+    reclaimed = {
+        'track': len(player.queue) + (player.current is not None),
+        'ffmpeg': (player.source is not None) + (player.prewarmed is not None),
+        'player': 1,
+    }
+    destroy_player(guild_id)
+    return reclaimed
+
+async def reap_voice_client(voice_client, reason):
+    guild = voice_client.guild
+    player = players.get(guild.id)
+    text_channel = guild.get_channel(player.text_channel_id) if player and player.text_channel_id else None
+    reclaimed = reap_player(guild.id)
+    try:
+        await voice_client.disconnect()  # Also stops and cleans up the playing source
+    except Exception as e:
+        print(f"Failed to disconnect from guild {guild.id}: {e}")
+    reclaimed['voice'] = 1
+    
+    if text_channel:
+        description = "ไม่มีผู้ฟังในช่องเสียง" if reason == 'empty' else "ไม่มีเพลงเล่นนานเกินไป"
+        embed = create_embed("👋 ออกจากช่องเสียงอัตโนมัติ", f"{description} บอทจึงออกจากช่องเสียง", 0xffaa00)
+        try:
+            await channel_bucket(text_channel.id).acquire()
+            await text_channel.send(embed=embed)
+        except discord.HTTPException:
+            pass
+    return reclaimed
+
+def prune_channel_buckets():
+    now = time.monotonic()
+    stale = [channel_id for channel_id, bucket in channel_buckets.items()
+             if not bucket.lock.locked() and (not bucket.sent or now - bucket.sent[-1] >= CHANNEL_RATE_PERIOD)
+             and channel_id not in pending_queue_replies]
+    for channel_id in stale:
+        del channel_buckets[channel_id]
+    return len(stale)
+
+async def reap_idle():
+    """One reaper pass; returns reclaimed resource counts"""
+    now = time.monotonic()
+    totals = {}
+    
+    def count(reclaimed, reason):
+        for resource, amount in reclaimed.items():
+            if amount:
+                totals[resource] = totals.get(resource, 0) + amount
+                reaped_resources.inc(amount, resource=resource, reason=reason)
+    
+    connected = set()
+    for voice_client in list(bot.voice_clients):
+        guild_id = voice_client.guild.id
+        connected.add(guild_id)
+        reason = idle_reason(voice_client)
+        if reason is None:
+            idle_since.pop(guild_id, None)
+            continue
+        seen = idle_since.get(guild_id)
+        if seen is None or seen[0] != reason:
+            idle_since[guild_id] = (reason, now)
+            continue
+        timeout = EMPTY_CHANNEL_TIMEOUT if reason == 'empty' else IDLE_TIMEOUT
+        if now - seen[1] >= timeout:
+            del idle_since[guild_id]
+            count(await reap_voice_client(voice_client, reason), reason)
+    
+    # Players left behind by a disconnect we did not initiate keep their queue
+    # for IDLE_TIMEOUT in case the bot is brought back
+    for guild_id in [guild_id for guild_id in players if guild_id not in connected]:
+        seen = idle_since.get(guild_id)
+        if seen is None or seen[0] != 'disconnected':
+            idle_since[guild_id] = ('disconnected', now)
+        elif now - seen[1] >= IDLE_TIMEOUT:
+            del idle_since[guild_id]
+            count(reap_player(guild_id), 'disconnected')
+    for guild_id in [guild_id for guild_id in idle_since if guild_id not in connected and guild_id not in players]:
+        del idle_since[guild_id]
+    count({'reply_bucket': prune_channel_buckets()}, 'quiet')
+    return totals
+
+async def idle_reaper_loop():
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL)
+        try:
+            totals = await reap_idle()
+        except Exception as e:
+            print(f"Idle reaper failed: {e}")
+            continue
+        if totals.keys() - {'reply_bucket'}:
+            print("🧹 Reclaimed " + ", ".join(f"{amount} {resource}" for resource, amount in sorted(totals.items())))
+
+def reaper_stats():
+    with reaped_resources.lock:
+        totals = {}
+        for key, amount in reaped_resources.values.items():
+            resource = dict(key)['resource']
+            totals[resource] = totals.get(resource, 0) + amount
+    return (f"ออก {totals.get('voice', 0)} ห้อง • {totals.get('track', 0)} เพลง • "
+            f"FFmpeg {totals.get('ffmpeg', 0)} • รอ {len(idle_since)}")
+
+# Metrics hooks
+@bot.before_invoke
+async def before_command(ctx):
+    ctx.started_at = time.perf_counter()
+    if ctx.guild:
+        # A command is activity; the reaper starts its idle clock over
+        idle_since.pop(ctx.guild.id, None)
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    command_latency.observe(time.perf_counter() - ctx.started_at, command=ctx.command.name)
+
+def collect_runtime_gauges():
+    queue_depths = [len(player.queue) for player in players.values()]
+    ffmpeg_processes = sum((player.source is not None) + (player.prewarmed is not None) for player in players.values())
+    return (
+        gauge_lines('musicbot_voice_sessions', "Connected voice clients", [({}, len(bot.voice_clients))])
+        + gauge_lines('musicbot_players', "Guild players", [({}, len(players))])
+        + gauge_lines('musicbot_queued_tracks', "Tracks waiting in all queues", [({}, sum(queue_depths))])
+        + gauge_lines('musicbot_max_queue_depth', "Longest guild queue", [({}, max(queue_depths, default=0))])
+        + gauge_lines('musicbot_ffmpeg_processes', "Playing and pre-warmed FFmpeg sources", [({}, ffmpeg_processes)])
+        + gauge_lines('musicbot_cache_hits', "Resolution cache hits", [
+            ({'cache': cache.name}, cache.hits) for cache in (query_cache, stream_cache)])
+        + gauge_lines('musicbot_cache_misses', "Resolution cache misses", [
+            ({'cache': cache.name}, cache.misses) for cache in (query_cache, stream_cache)])
+    )
+
+metric_collectors.append(collect_runtime_gauges)
+
 # Bot events
 @bot.event
 async def on_ready():
+    global startup_seconds
+    if startup_seconds is None:
+        startup_seconds = round(time.monotonic() - boot_started_at, 2)
+        stage_latency.observe(startup_seconds, stage='startup')
+        print(f'✅ Ready in {startup_seconds}s')
     print(f'✅ {bot.user} has logged in!')
     print(f'✅ Bot is in {len(bot.guilds)} servers')
     print(f'✅ Primary method: {current_primary_method}')
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="!play"))
+    start_ytdl_warmup()
+    await restore_sessions()
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -249,7 +2339,7 @@ async def join(ctx):
     """Join voice channel"""
     if not ctx.author.voice:
         embed = create_embed("❌ ข้อผิดพลาด", "คุณต้องอยู่ในช่องเสียงก่อน!", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
         return
     
     channel = ctx.author.voice.channel
@@ -259,24 +2349,40 @@ async def join(ctx):
         await channel.connect()
     
     embed = create_embed("🎵 เข้าร่วมช่องเสียงแล้ว", f"เข้าร่วมช่องเสียง **{channel.name}** แล้ว พร้อมเปิดเพลง!")
-    await ctx.send(embed=embed)
+    await reply(ctx, embed)
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.describe(query="ชื่อเพลงหรือลิงก์")
 async def play(ctx, *, query):
     """เล่นเพลงจาก YouTube"""
     global current_primary_method, current_ytdl_config, usage_count, last_method_switch
     
     if not ctx.author.voice:
         embed = create_embed("❌ ข้อผิดพลาด", "คุณต้องอยู่ในช่องเสียงก่อน!", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
         return
     
+    await ctx.defer()  # Slash commands must be acknowledged within 3 seconds
+    # A chosen suggestion carries its video id, so no search is needed
+    video_id = suggestion_video_id(query)
+    if video_id:
+        query = f"https://www.youtube.com/watch?v={video_id}"
+    
     if ctx.voice_client is None:
         await ctx.author.voice.channel.connect()
     
+    if is_playlist_url(query):
+        rotate_method()
+        cancel_playlist(ctx.guild.id)
+        playlist_tasks[ctx.guild.id] = bot.loop.create_task(ingest_playlist(ctx, ctx.guild.id, query))
+        embed = create_embed("📥 กำลังโหลดเพลย์ลิสต์", "เพลงแรกจะเริ่มเล่นทันทีที่พร้อม ส่วนที่เหลือจะถูกเพิ่มในคิวเรื่อย ๆ")
+        await reply(ctx, embed)
+        return
+    
     async with ctx.typing():
         try:
-            player = None
+            data = None
+            method = None
             method_used = "ไม่ทราบ"
             
             # Rotate method to avoid detection
@@ -286,12 +2392,14 @@ async def play(ctx, *, query):
             if current_primary_method == "invidious":
                 # Try Invidious first, then yt-dlp
                 try:
-                    player = await InvidiousSource.from_query(query, loop=bot.loop)
+                    data = await InvidiousSource.fetch(query, video_id=video_id)
+                    method = "invidious"
                     method_used = "Invidious"
                 except Exception as e1:
                     print(f"Invidious failed: {e1}")
                     try:
-                        player = await YTDLSource.from_url(query, loop=bot.loop, stream=True)
+                        data = await YTDLSource.extract(query, loop=bot.loop)
+                        method = "ytdl"
                         method_used = f"YouTube Direct (Config {current_ytdl_config + 1})"
                     except Exception as e2:
                         print(f"yt-dlp failed: {e2}")
@@ -299,29 +2407,34 @@ async def play(ctx, *, query):
             else:
                 # Try yt-dlp first, then Invidious
                 try:
-                    player = await YTDLSource.from_url(query, loop=bot.loop, stream=True)
+                    data = await YTDLSource.extract(query, loop=bot.loop)
+                    method = "ytdl"
                     method_used = f"YouTube Direct (Config {current_ytdl_config + 1})"
                 except Exception as e1:
                     print(f"yt-dlp failed: {e1}")
                     try:
-                        player = await InvidiousSource.from_query(query, loop=bot.loop)
+                        data = await InvidiousSource.fetch(query, video_id=video_id)
+                        method = "invidious"
                         method_used = "Invidious"
                     except Exception as e2:
                         print(f"Invidious failed: {e2}")
                         raise Exception(f"ไม่สามารถดึงข้อมูลเพลงได้: {str(e2)}")
             
-            if player:
-                if not ctx.voice_client.is_playing():
-                    ctx.voice_client.play(player, after=lambda x=None: check_queue(ctx, ctx.guild.id))
-                    embed = create_embed("🎵 กำลังเล่นเพลง", f"**{player.title}**\n\nผ่าน: {method_used}\n\nขอให้คุณสนุกกับการฟังเพลง! 🎶")
-                    await ctx.send(embed=embed)
+            if data and ctx.voice_client is None:
+                # Disconnected while resolving, e.g. by the idle reaper
+                embed = create_embed("❌ ข้อผิดพลาด", "บอทไม่ได้อยู่ในช่องเสียงแล้ว กรุณาลองใหม่อีกครั้ง", 0xff0000)
+                await reply(ctx, embed)
+            elif data:
+                track = Track.from_data(query, data, method)
+                player = get_player(ctx.guild)
+                player.text_channel_id = ctx.channel.id
+                if player.is_idle():
+                    player.add(track)
+                    embed = create_embed("🎵 กำลังเล่นเพลง", f"**{track.title}**\n\nผ่าน: {method_used}\n\nขอให้คุณสนุกกับการฟังเพลง! 🎶")
+                    await reply(ctx, embed)
                 else:
-                    guild_id = ctx.guild.id
-                    if guild_id not in queues:
-                        queues[guild_id] = []
-                    queues[guild_id].append(player)
-                    embed = create_embed("✅ เพิ่มเพลงในคิวแล้ว", f"**{player.title}**\n\nตำแหน่งในคิว: #{len(queues[guild_id])}")
-                    await ctx.send(embed=embed)
+                    position = player.add(track)
+                    await reply_queued(ctx, track.title, position)
                 
         except Exception as e:
             error_msg = str(e)
@@ -334,18 +2447,64 @@ async def play(ctx, *, query):
                 f"**ข้อความ:** {error_msg}\n\n"
                 f"กำลังลองวิธีอื่น...\n"
                 f"กรุณาลองคำสั่งอีกครั้ง", 0xff0000)
-            await ctx.send(embed=embed)
+            await reply(ctx, embed)
+
+@play.autocomplete('query')
+async def play_autocomplete(interaction, current):
+    with stage_latency.time(stage='autocomplete'):
+        if current.startswith(('http://', 'https://', SUGGESTION_PREFIX)):
+            return []
+        matches = suggestion_index.search(current)
+        if len(matches) < SUGGEST_MIN_LOCAL and len(current.strip()) >= 3 and await search_suggestions(current):
+            matches = suggestion_index.search(current)
+    choices = []
+    for video_id, title, duration in matches:
+        suffix = f" ({clock_time(duration)})" if duration else ""
+        name = title[:100 - len(suffix)] + suffix
+        choices.append(app_commands.Choice(name=name, value=SUGGESTION_PREFIX + video_id))
+    return choices
 
 @bot.command()
 async def status(ctx):
     """แสดงสถานะบอท"""
+    shard_lines = ""
+    workers = await collect_shard_stats()
+    if workers:
+        shard_lines = (
+            f"**โปรเซส:** {len(workers)} • ชาร์ด {sum(len(w['shards']) for w in workers)}\n"
+            f"**รวมทุกโปรเซส:** {sum(w['guilds'] for w in workers)} เซิร์ฟเวอร์ • "
+            f"เล่นอยู่ {sum(w['playing'] for w in workers)} • คิว {sum(w['queued'] for w in workers)} เพลง\n"
+        )
+    elif AUTO_SHARD:
+        shard_lines = f"**ชาร์ด:** {', '.join(f'#{shard_id} {latency * 1000:.0f}ms' for shard_id, latency in bot.latencies)}\n"
     embed = create_embed("📊 สถานะบอท", 
+        shard_lines +
         f"**วิธีการหลัก:** {current_primary_method}\n"
         f"**จำนวนการใช้งาน:** {usage_count}\n"
         f"**คอนฟิก yt-dlp:** {current_ytdl_config + 1}\n"
+        f"**แคชคำค้นหา:** {query_cache.stats()}\n"
+        f"**แคชสตรีม:** {stream_cache.stats()}\n"
+        f"**แคชไฟล์เสียง:** {audio_cache.stats()}\n"
+        f"**ดัชนีคำแนะนำ:** {len(suggestion_index.entries)} เพลง\n"
+        f"**โหมดเสียง:** {'Opus passthrough' if OPUS_PASSTHROUGH else 'PCM'}\n"
+        f"**ช่องว่างระหว่างเพลง:** {gap_stats()}\n"
+        f"**เก็บกวาด:** {reaper_stats()}\n"
+        f"**p50/p95:** Invidious {latency_summary(stage_latency, stage='invidious_resolve')}"
+        f" • yt-dlp {latency_summary(stage_latency, stage='ytdl_extract')}"
+        f" • FFmpeg {latency_summary(stage_latency, stage='ffmpeg_first_frame')}\n"
+        f"**!play p50/p95:** {latency_summary(command_latency, command='play')}\n"
+        f"**Invidious:** {sum(not h.is_benched() for h in instance_health.values())}/{len(instance_health)} พร้อมใช้"
+        f" • เร็วสุด: {', '.join(urlparse(h.url).netloc for h in ranked_instances()[:3])}\n"
         f"**เซิร์ฟเวอร์:** {len(bot.guilds)}\n"
         f"**พิง:** {round(bot.latency * 1000)}ms", 0x0099ff)
-    await ctx.send(embed=embed)
+    await reply(ctx, embed)
+
+@bot.command()
+async def instances(ctx):
+    """แสดงสถานะ Invidious instances"""
+    lines = "\n".join(h.describe() for h in ranked_instances())
+    embed = create_embed("🌐 Invidious Instances", lines or "❌ ไม่มี instance", 0x0099ff, show_large_image=False)
+    await reply(ctx, embed)
 
 @bot.command()
 async def pause(ctx):
@@ -353,10 +2512,10 @@ async def pause(ctx):
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.pause()
         embed = create_embed("⏸️ หยุดชั่วคราว", "เพลงถูกหยุดชั่วคราวแล้ว ใช้ `!resume` เพื่อเล่นต่อ", 0xffa500)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
     else:
         embed = create_embed("❌ ข้อผิดพลาด", "ไม่มีเพลงที่กำลังเล่นอยู่", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
 
 @bot.command()
 async def resume(ctx):
@@ -364,24 +2523,25 @@ async def resume(ctx):
     if ctx.voice_client and ctx.voice_client.is_paused():
         ctx.voice_client.resume()
         embed = create_embed("▶️ เล่นต่อ", "เพลงกำลังเล่นต่อแล้ว! 🎶", 0x00ff00)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
     else:
         embed = create_embed("❌ ข้อผิดพลาด", "ไม่มีเพลงที่ถูกหยุดชั่วคราว", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
 
 @bot.command()
 async def stop(ctx):
     """หยุดเพลงและล้างคิว"""
+    guild_id = ctx.guild.id
+    cancel_playlist(guild_id)
+    if guild_id in players:
+        players[guild_id].clear()
+    
     if ctx.voice_client:
         if ctx.voice_client.is_playing():
             ctx.voice_client.stop()
     
-    guild_id = ctx.guild.id
-    if guild_id in queues:
-        queues[guild_id] = []
-    
     embed = create_embed("⏹️ หยุดเพลง", "เพลงถูกหยุดและคิวถูกล้างเรียบร้อยแล้ว", 0xff0000)
-    await ctx.send(embed=embed)
+    await reply(ctx, embed)
 
 @bot.command()
 async def skip(ctx):
@@ -389,26 +2549,112 @@ async def skip(ctx):
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.stop()
         embed = create_embed("⏭️ ข้ามเพลง", "ข้ามเพลงปัจจุบันเรียบร้อยแล้ว!", 0x00ff00)
-        await ctx.send(embed=embed)
-        check_queue(ctx, ctx.guild.id)
+        await reply(ctx, embed)
     else:
         embed = create_embed("❌ ข้อผิดพลาด", "ไม่มีเพลงที่กำลังเล่นอยู่", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
+
+QUEUE_PAGE_SIZE = 10
+
+def clock_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def format_duration(seconds):
+    if not seconds:
+        return ""
+    return f" `{clock_time(seconds)}`"
 
 @bot.command()
-async def queue(ctx):
+async def queue(ctx, page: int = 1):
     """แสดงคิวเพลง"""
-    guild_id = ctx.guild.id
-    if guild_id in queues and queues[guild_id]:
-        queue_list = "\n".join([f"**{i+1}.** {song.title}" for i, song in enumerate(queues[guild_id])])
-        if len(queue_list) > 2000:
-            queue_list = queue_list[:1997] + "..."
+    player = players.get(ctx.guild.id)
+    if player and len(player.queue):
+        total = len(player.queue)
+        pages = (total + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+        page = min(max(page, 1), pages)
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        # Only the visible page is formatted, however long the queue is
+        queue_list = "\n".join(
+            f"**{start + i + 1}.** {song.title[:80]}{format_duration(song.duration)}"
+            for i, song in enumerate(player.queue.page(start, QUEUE_PAGE_SIZE))
+        )
         
-        embed = create_embed("📋 คิวเพลง", f"มี {len(queues[guild_id])} เพลงในคิว:\n\n{queue_list}", 0x0099ff)
-        await ctx.send(embed=embed)
+        embed = create_embed("📋 คิวเพลง", f"มี {total} เพลงในคิว:\n\n{queue_list}\n\nหน้า {page}/{pages} • ใช้ `!queue [หน้า]`", 0x0099ff)
+        await reply(ctx, embed)
     else:
         embed = create_embed("📋 คิวเพลง", "❌ ไม่มีเพลงในคิว", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
+
+def queue_position(player, position):
+    """Validate a 1-based queue position from a command"""
+    return player is not None and 1 <= position <= len(player.queue)
+
+@bot.command()
+async def remove(ctx, position: int):
+    """ลบเพลงออกจากคิว"""
+    player = players.get(ctx.guild.id)
+    if not queue_position(player, position):
+        embed = create_embed("❌ ข้อผิดพลาด", "ไม่พบตำแหน่งนี้ในคิว", 0xff0000)
+        return await reply(ctx, embed)
+    
+    track = player.queue.remove(position - 1)
+    track.release()
+    player.queue_changed()
+    embed = create_embed("🗑️ ลบเพลงแล้ว", f"**{track.title}**\n\nถูกลบออกจากคิวแล้ว", 0x00ff00)
+    await reply(ctx, embed)
+
+@bot.command()
+async def move(ctx, position: int, new_position: int):
+    """ย้ายตำแหน่งเพลงในคิว"""
+    player = players.get(ctx.guild.id)
+    if not queue_position(player, position) or not queue_position(player, new_position):
+        embed = create_embed("❌ ข้อผิดพลาด", "ไม่พบตำแหน่งนี้ในคิว", 0xff0000)
+        return await reply(ctx, embed)
+    
+    track = player.queue.move(position - 1, new_position - 1)
+    player.queue_changed()
+    embed = create_embed("↕️ ย้ายเพลงแล้ว", f"**{track.title}**\n\nย้ายไปตำแหน่ง #{new_position}", 0x00ff00)
+    await reply(ctx, embed)
+
+@bot.command()
+async def jump(ctx, position: int):
+    """ข้ามไปยังเพลงในตำแหน่งที่กำหนด"""
+    player = players.get(ctx.guild.id)
+    if not queue_position(player, position):
+        embed = create_embed("❌ ข้อผิดพลาด", "ไม่พบตำแหน่งนี้ในคิว", 0xff0000)
+        return await reply(ctx, embed)
+    
+    player.queue.drop_front(position - 1)
+    player.queue_changed()
+    if ctx.voice_client and (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()):
+        ctx.voice_client.stop()
+    embed = create_embed("⏩ ข้ามไปยังเพลง", f"**{player.queue.peek(1)[0].title}**", 0x00ff00)
+    await reply(ctx, embed)
+
+@bot.command()
+async def shuffle(ctx):
+    """สลับลำดับเพลงในคิว"""
+    player = players.get(ctx.guild.id)
+    if not player or len(player.queue) < 2:
+        embed = create_embed("❌ ข้อผิดพลาด", "มีเพลงในคิวไม่พอให้สลับ", 0xff0000)
+        return await reply(ctx, embed)
+    
+    player.queue.shuffle()
+    player.queue_changed()
+    embed = create_embed("🔀 สลับคิวแล้ว", f"สลับลำดับ {len(player.queue)} เพลงเรียบร้อยแล้ว", 0x00ff00)
+    await reply(ctx, embed)
+
+@bot.command()
+async def dedup(ctx):
+    """ลบเพลงซ้ำในคิว"""
+    player = players.get(ctx.guild.id)
+    removed = player.queue.dedup() if player else 0
+    if player:
+        player.queue_changed()
+    embed = create_embed("🧹 ลบเพลงซ้ำ", f"ลบเพลงซ้ำออก {removed} เพลง", 0x00ff00)
+    await reply(ctx, embed)
 
 @bot.command()
 async def leave(ctx):
@@ -416,62 +2662,74 @@ async def leave(ctx):
     if ctx.voice_client:
         await ctx.voice_client.disconnect()
         embed = create_embed("👋 ออกจากช่องเสียง", "บอทได้ออกจากช่องเสียงแล้ว ขอบคุณที่ใช้บริการ! 🎵", 0x00ff00)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
         
         guild_id = ctx.guild.id
-        if guild_id in queues:
-            del queues[guild_id]
+        cancel_playlist(guild_id)
+        destroy_player(guild_id)
     else:
         embed = create_embed("❌ ข้อผิดพลาด", "บอทไม่ได้อยู่ในช่องเสียง", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
 
 @bot.command()
 async def ping(ctx):
     """ทดสอบการตอบสนอง"""
     latency = round(bot.latency * 1000)
     embed = create_embed("🏓 Pong!", f"ความเร็วในการตอบสนอง: **{latency}ms**\n\nบอททำงานปกติ! ✅", 0x00ff00)
-    await ctx.send(embed=embed)
+    await reply(ctx, embed)
 
 @bot.command()
 async def volume(ctx, volume: int):
     """ปรับระดับเสียง (0-100)"""
     if ctx.voice_client is None:
         embed = create_embed("❌ ข้อผิดพลาด", "ไม่ได้เชื่อมต่อกับช่องเสียง", 0xff0000)
-        return await ctx.send(embed=embed)
+        return await reply(ctx, embed)
     
     if 0 <= volume <= 100:
-        if ctx.voice_client.source:
+        get_player(ctx.guild).set_volume(volume / 100)
+        note = ""
+        if isinstance(ctx.voice_client.source, OpusSource):
+            # FFmpeg applies Opus-mode volume, so it takes effect from the next track
+            note = "\n\nจะมีผลตั้งแต่เพลงถัดไป"
+        elif ctx.voice_client.source:
             ctx.voice_client.source.volume = volume / 100
-        embed = create_embed("🔊 ระดับเสียง", f"ตั้งค่าระดับเสียงเป็น **{volume}%** แล้ว", 0x00ff00)
-        await ctx.send(embed=embed)
+        embed = create_embed("🔊 ระดับเสียง", f"ตั้งค่าระดับเสียงเป็น **{volume}%** แล้ว{note}", 0x00ff00)
+        await reply(ctx, embed)
     else:
         embed = create_embed("❌ ข้อผิดพลาด", "กรุณาใส่ตัวเลขระหว่าง 0-100", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
 
 @bot.command()
 async def nowplaying(ctx):
     """แสดงเพลงที่กำลังเล่นอยู่"""
     if ctx.voice_client and ctx.voice_client.is_playing():
         embed = create_embed("🎵 กำลังเล่นอยู่", "กำลังเล่นเพลง...\n\nใช้ `!queue` เพื่อดูคิวเพลง", 0x00ff00)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
     else:
         embed = create_embed("🎵 กำลังเล่นอยู่", "❌ ไม่มีเพลงที่กำลังเล่นอยู่", 0xff0000)
-        await ctx.send(embed=embed)
+        await reply(ctx, embed)
 
 @bot.command()
 async def help_bot(ctx):
     """แสดงคำสั่งทั้งหมด"""
     commands_list = """
 **🎵 คำสั่งเพลง:**
-`!play [ชื่อเพลง/ลิงก์]` - เล่นเพลงจาก YouTube
+`!play [ชื่อเพลง/ลิงก์]` - เล่นเพลงหรือเพลย์ลิสต์จาก YouTube
+`/play` - ค้นหาเพลงพร้อมคำแนะนำขณะพิมพ์
 `!pause` - หยุดเพลงชั่วคราว
 `!resume` - เล่นเพลงต่อ
 `!stop` - หยุดและล้างคิว
 `!skip` - ข้ามเพลงปัจจุบัน
-`!queue` - แสดงคิวเพลง
+`!queue [หน้า]` - แสดงคิวเพลง
+`!remove [ตำแหน่ง]` - ลบเพลงออกจากคิว
+`!move [จาก] [ไป]` - ย้ายตำแหน่งเพลงในคิว
+`!jump [ตำแหน่ง]` - ข้ามไปยังเพลงในคิว
+`!shuffle` - สลับลำดับเพลงในคิว
+`!dedup` - ลบเพลงซ้ำในคิว
 `!volume [0-100]` - ปรับระดับเสียง
 `!nowplaying` - แสดงเพลงที่กำลังเล่น
 `!status` - แสดงสถานะบอท
+`!instances` - แสดงสถานะ Invidious instances
 
 **🔊 คำสั่งเสียง:**
 `!join` - เข้าร่วมช่องเสียง
@@ -482,7 +2740,102 @@ async def help_bot(ctx):
 `!help_bot` - แสดงคำสั่งทั้งหมด
 """
     embed = create_embed("🤖 คำสั่งบอท", commands_list, 0x0099ff)
-    await ctx.send(embed=embed)
+    await reply(ctx, embed)
+
+# Multi-process supervisor
+async def fetch_recommended_shard_count(token):
+    headers = {'Authorization': f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers=headers) as resp:
+            resp.raise_for_status()
+            return (await resp.json())['shards']
+
+def split_shards(shard_count, processes):
+    """Contiguous shard ranges, one per worker process"""
+    processes = min(processes, shard_count)
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append((start, end - 1))
+        start = end
+    return ranges
+
+def worker_path(path, label):
+    """resolution_cache.db -> resolution_cache.worker-0.db; empty stays disabled"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{label}{ext}"
+
+def run_supervisor(token):
+    """Run one worker process per shard range and restart any that fail"""
+    shard_count = SHARD_COUNT or asyncio.run(fetch_recommended_shard_count(token))
+    ranges = split_shards(max(shard_count, SHARD_PROCESSES), SHARD_PROCESSES)
+    shard_count = ranges[-1][1] + 1
+    
+    authkey = secrets.token_bytes(16)
+    coordinator = ShardCoordinator(address=('127.0.0.1', 0), authkey=authkey)
+    server = coordinator.get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = f"{server.address[0]}:{server.address[1]}"
+    
+    # Caches are tracked per process, so each worker gets its own files and
+    # an equal share of the audio cache budget. Sessions stay shared; workers
+    # only touch the guilds they own.
+    audio_cache_mb = AUDIO_CACHE_MAX_BYTES // (1024 * 1024)
+    if audio_cache_mb:
+        audio_cache_mb = max(1, audio_cache_mb // len(ranges))
+    
+    def launch(index):
+        first, last = ranges[index]
+        label = f"worker-{index}"
+        env = {
+            **os.environ,
+            'SHARD_COUNT': str(shard_count),
+            'SHARD_IDS': f"{first}-{last}",
+            'SHARD_PROCESSES': '1',
+            'SHARD_COORDINATOR': address,
+            'SHARD_COORDINATOR_KEY': authkey.hex(),
+            'SHARD_LABEL': label,
+            'RESOLUTION_CACHE_DB': worker_path(RESOLUTION_CACHE_DB, label),
+            'AUDIO_CACHE_DIR': os.path.join(AUDIO_CACHE_DIR, label),
+            'AUDIO_CACHE_MAX_MB': str(audio_cache_mb),
+            # Each worker serves its own metrics on the next port up
+            'METRICS_PORT': str(METRICS_PORT + index + 1 if METRICS_PORT else 0),
+        }
+        print(f"🚀 Starting worker {index} for shards {first}-{last} of {shard_count}")
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+    
+    workers = {index: launch(index) for index in range(len(ranges))}
+    restarts = {index: 0 for index in workers}
+    restart_at = {}  # index -> monotonic deadline for a crashed worker
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while workers or restart_at:
+            time.sleep(5)
+            for index, process in list(workers.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                del workers[index]
+                shard_stats_store.pop(f"worker-{index}", None)
+                if code == 0:
+                    continue
+                restarts[index] += 1
+                delay = min(5 * 2 ** (restarts[index] - 1), 300)
+                print(f"⚠️ Worker {index} exited with {code}, restarting in {delay}s")
+                restart_at[index] = time.monotonic() + delay
+            now = time.monotonic()
+            for index, deadline in list(restart_at.items()):
+                if now >= deadline:
+                    del restart_at[index]
+                    workers[index] = launch(index)
+    finally:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.wait()
 
 # Run bot
 if __name__ == "__main__":
@@ -490,6 +2843,9 @@ if __name__ == "__main__":
     if not token:
         print("❌ ตั้งค่า DISCORD_TOKEN ใน Environment Variables")
         print("💡 ไปที่ Railway Dashboard → Variables → Add DISCORD_TOKEN")
+    elif SHARD_PROCESSES > 1 and not SHARD_COORDINATOR:
+        print(f"🎵 เริ่มต้นบอทเพลงแบบหลายโปรเซส ({SHARD_PROCESSES} โปรเซส)...")
+        run_supervisor(token)
     else:
         print("🎵 เริ่มต้นบอทเพลง Discord บน Railway...")
         print(f"✅ วิธีการเริ่มต้น: {current_primary_method}")
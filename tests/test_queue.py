@@ -0,0 +1,261 @@
+"""Queue operations against a running GuildPlayer, with Discord and FFmpeg faked out."""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+os.environ.setdefault('RESOLUTION_CACHE_DB', '')
+os.environ.setdefault('SESSION_DB', '')
+os.environ.setdefault('AUDIO_CACHE_MAX_MB', '0')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('CHANNEL_RATE_LIMIT', '1000000')
+os.environ.setdefault('REPLY_COALESCE_WINDOW', '0')
+os.environ.setdefault('VOICE_RETRY_SECONDS', '0.01')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+TRACK_SECONDS = 100
+
+class FakeSource:
+    def __init__(self, track):
+        self.track = track
+        self.elapsed = TRACK_SECONDS  # Already inside the pre-warm window
+        self.started_at = None
+        self.cleaned = False
+
+    def cleanup(self):
+        self.cleaned = True
+
+class FakeVoiceClient:
+    def __init__(self):
+        self.source = None
+        self.after = None
+        self.paused = False
+
+    def play(self, source, *, after=None):
+        self.source = source
+        self.after = after
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def is_connected(self):
+        return True
+
+    def stop(self):
+        source, after = self.source, self.after
+        self.source = self.after = None
+        if source is not None:
+            source.cleanup()
+            after(None)
+
+class FakeGuild:
+    def __init__(self):
+        self.id = 1
+        self.voice_client = FakeVoiceClient()
+
+class FakeChannel:
+    id = 2
+
+class FakeContext:
+    interaction = None
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.channel = FakeChannel()
+        self.sent = []
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, *, embed=None):
+        self.sent.append(embed)
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """Records the sources the player opens and the titles it resolves"""
+    opened = []
+    resolved = []
+
+    async def resolve_track(track, *, loop=None):
+        resolved.append(track.title)
+        track.set_data({'id': track.video_id, 'url': f"http://stream/{track.video_id}", 'title': track.title})
+
+    def create_source(track, volume=main.DEFAULT_VOLUME):
+        source = FakeSource(track)
+        opened.append(source)
+        return source
+
+    monkeypatch.setattr(main, 'resolve_track', resolve_track)
+    monkeypatch.setattr(main, 'create_source', create_source)
+    return SimpleNamespace(opened=opened, resolved=resolved)
+
+def run(coro):
+    async def wrapper():
+        main.bot.loop = asyncio.get_running_loop()
+        try:
+            return await coro
+        finally:
+            for guild_id in list(main.players):
+                main.destroy_player(guild_id)
+    return asyncio.run(wrapper())
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def start_player(titles):
+    guild = FakeGuild()
+    player = main.get_player(guild)
+    for title in titles:
+        player.add(main.Track(title, video_id=title, title=title, duration=TRACK_SECONDS))
+    await settle()
+    return guild, player, FakeContext(guild)
+
+def titles(player):
+    return [track.title for track in player.queue]
+
+def assert_bookkeeping(player):
+    # Every waiting track is one unfinished task; player_loop marks the rest done
+    assert player.queue._unfinished_tasks == len(player.queue)
+
+def test_move_discards_stale_prewarm(fakes):
+    async def scenario():
+        guild, player, ctx = await start_player(['a', 'b', 'c', 'd'])
+        assert player.current.title == 'a'
+        assert player.prewarmed[0].title == 'b'
+        stale = player.prewarmed[1]
+
+        await main.move.callback(ctx, 3, 1)
+        assert titles(player) == ['d', 'b', 'c']
+        assert stale.cleaned
+        await settle()
+        assert player.prewarmed[0].title == 'd'
+        assert_bookkeeping(player)
+
+        guild.voice_client.stop()
+        await settle()
+        assert player.current.title == 'd'
+        assert guild.voice_client.source.track.title == 'd'
+        assert titles(player) == ['b', 'c']
+        assert_bookkeeping(player)
+    run(scenario())
+
+def test_move_keeping_next_track_keeps_prewarm(fakes):
+    async def scenario():
+        guild, player, ctx = await start_player(['a', 'b', 'c', 'd'])
+        prewarmed = player.prewarmed
+
+        await main.move.callback(ctx, 3, 2)
+        assert titles(player) == ['b', 'd', 'c']
+        assert player.prewarmed is prewarmed
+        assert not prewarmed[1].cleaned
+    run(scenario())
+
+def test_remove_next_track(fakes):
+    async def scenario():
+        guild, player, ctx = await start_player(['a', 'b', 'c'])
+        stale = player.prewarmed[1]
+
+        await main.remove.callback(ctx, 1)
+        assert titles(player) == ['c']
+        assert stale.cleaned
+        await settle()
+        assert player.prewarmed[0].title == 'c'
+        assert_bookkeeping(player)
+    run(scenario())
+
+def test_jump_plays_target(fakes):
+    async def scenario():
+        guild, player, ctx = await start_player(['a', 'b', 'c', 'd', 'e'])
+
+        await main.jump.callback(ctx, 3)
+        await settle()
+        assert player.current.title == 'd'
+        assert titles(player) == ['e']
+        assert_bookkeeping(player)
+        # Only the playing and the pre-warmed pipeline may stay open
+        assert [source.track.title for source in fakes.opened if not source.cleaned] == ['d', 'e']
+    run(scenario())
+
+def test_dedup_shuffle_and_clear(fakes):
+    async def scenario():
+        guild, player, ctx = await start_player(['a', 'b', 'c', 'b', 'c', 'd'])
+
+        await main.dedup.callback(ctx)
+        assert titles(player) == ['b', 'c', 'd']
+        assert_bookkeeping(player)
+
+        await main.shuffle.callback(ctx)
+        assert sorted(titles(player)) == ['b', 'c', 'd']
+        assert player.prewarmed is None or player.prewarmed[0] is player.queue.peek(1)[0]
+        assert_bookkeeping(player)
+
+        await main.stop.callback(ctx)
+        await settle()
+        assert len(player.queue) == 0
+        assert player.prewarmed is None
+        await asyncio.wait_for(player.queue.join(), 1)
+        assert all(source.cleaned for source in fakes.opened)
+    run(scenario())
+
+def test_queue_is_held_while_voice_is_gone(fakes, monkeypatch):
+    monkeypatch.setattr(main, 'PREFETCH_TRACKS', 0)  # Only count lookups made by the player loop
+
+    async def scenario():
+        guild = FakeGuild()
+        voice_client, guild.voice_client = guild.voice_client, None
+        player = main.get_player(guild)
+        for title in ['a', 'b', 'c']:
+            player.add(main.Track(title, video_id=title, title=title, duration=TRACK_SECONDS))
+        await asyncio.sleep(0.05)
+        assert fakes.resolved == []
+        assert titles(player) == ['b', 'c']  # 'a' is waiting inside the player
+
+        guild.voice_client = voice_client
+        await asyncio.sleep(0.05)
+        assert player.current.title == 'a'
+        assert titles(player) == ['b', 'c']
+    run(scenario())
+
+def test_track_is_requeued_when_play_fails(fakes):
+    async def scenario():
+        guild = FakeGuild()
+        attempts = []
+        play = guild.voice_client.play
+
+        def flaky_play(source, *, after=None):
+            attempts.append(source.track.title)
+            if len(attempts) == 1:
+                raise main.discord.ClientException('Not connected to voice.')
+            play(source, after=after)
+        guild.voice_client.play = flaky_play
+
+        player = main.get_player(guild)
+        for title in ['a', 'b']:
+            player.add(main.Track(title, video_id=title, title=title, duration=TRACK_SECONDS))
+        await asyncio.sleep(0.05)
+        assert attempts == ['a', 'a']
+        assert player.current.title == 'a'
+        assert titles(player) == ['b']
+        assert_bookkeeping(player)
+        assert not player.task.done()
+    run(scenario())
+
+def test_volume_reaches_prewarmed_source(fakes):
+    async def scenario():
+        guild, player, ctx = await start_player(['a', 'b'])
+        prewarmed = player.prewarmed[1]
+
+        await main.volume.callback(ctx, 30)
+        assert guild.voice_client.source.volume == 0.3
+        assert prewarmed.volume == 0.3
+        assert player.prewarmed[1] is prewarmed
+    run(scenario())